@@ -0,0 +1,266 @@
+import bz2
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+from utils import *
+import process_node_information
+from process_node_information import get_node_data, get_all_attributes, extract_node_data_from_dump
+from triple_store import open_triple_store, NegativeSampler
+
+
+def synthetic_entity(number, rng, claim_count=20, languages=('en',), entity_type='item', max_target=10 ** 8):
+    #entity in the wikidata json layout with string, monolingualtext and wikibase-item claims, the monolingual
+    #texts cycle over the languages
+    entity_id = ('Q%d' if entity_type == 'item' else 'P%d') % number
+    claims = {}
+    for i in range(claim_count):
+        property_id = 'P%d' % rng.randint(1, 10000)
+        kind = i % 3
+        if kind == 0:
+            mainsnak = {'snaktype': 'value', 'property': property_id, 'datatype': 'string',
+                        'datavalue': {'type': 'string', 'value': 'value %d' % i}}
+        elif kind == 1:
+            mainsnak = {'snaktype': 'value', 'property': property_id, 'datatype': 'monolingualtext',
+                        'datavalue': {'type': 'monolingualtext', 'value': {'text': 'text %d' % i, 'language': languages[i % len(languages)]}}}
+        else:
+            target = rng.randint(1, max_target)
+            mainsnak = {'snaktype': 'value', 'property': property_id, 'datatype': 'wikibase-item',
+                        'datavalue': {'type': 'wikibase-entityid', 'value': {'entity-type': 'item', 'numeric-id': target, 'id': 'Q%d' % target}}}
+        claims.setdefault(property_id, []).append({'mainsnak': mainsnak, 'type': 'statement', 'rank': 'normal'})
+    return {
+        'type': entity_type,
+        'id': entity_id,
+        'labels': {lang: {'language': lang, 'value': 'label of %s' % entity_id} for lang in languages},
+        'descriptions': {lang: {'language': lang, 'value': 'description of %s' % entity_id} for lang in languages},
+        'aliases': {lang: [{'language': lang, 'value': 'alias of %s' % entity_id}] for lang in languages},
+        'sitelinks': {'%swiki' % lang: {'site': '%swiki' % lang, 'title': 'Title of %s' % entity_id} for lang in languages},
+        'claims': claims,
+    }
+
+def write_synthetic_dump(data_path, item_count=20000, property_count=500, languages=('en',), claim_count=20, target_ratio=0.1, seed=0):
+    """writes dump.json.bz2 in the layout of the wikidata json dumps, one entity per line inside a json array, with
+    the entities.txt, properties.txt and targets.txt id files read by the extractor. returns the file paths with the
+    line count and the decompressed size of the dump"""
+    rng = random.Random(seed)
+    data_path = os.path.abspath(data_path)
+    os.makedirs(data_path, exist_ok=True)
+    dump_info = {'dump_path': os.path.join(data_path, 'dump.json.bz2'), 'lines': 0, 'bytes': 0}
+    nodes = [('item', number) for number in range(1, item_count+1)] + [('property', number) for number in range(1, property_count+1)]
+    with bz2.open(dump_info['dump_path'], 'wb') as dump_file:
+        def write(line):
+            dump_file.write(line)
+            dump_info['lines'] += 1
+            dump_info['bytes'] += len(line)
+        write(b'[\n')
+        for i, (entity_type, number) in enumerate(nodes):
+            entity = synthetic_entity(number, rng, claim_count, languages, entity_type, item_count)
+            write(json.dumps(entity).encode('utf-8') + (b',\n' if i + 1 < len(nodes) else b'\n'))
+        write(b']\n')
+    dump_info['compressed_bytes'] = os.path.getsize(dump_info['dump_path'])
+    id_files = {
+        'entities': ['Q%d' % number for number in range(1, item_count+1)],
+        'properties': ['P%d' % number for number in range(1, property_count+1)],
+        'targets': ['Q%d' % number for number in sorted(rng.sample(range(1, item_count+1), int(item_count * target_ratio)))],
+    }
+    for name, node_ids in id_files.items():
+        dump_info['%s_file' % name] = os.path.join(data_path, '%s.txt' % name)
+        with open(dump_info['%s_file' % name], 'w') as id_file:
+            id_file.write('\n'.join(node_ids) + '\n')
+    return dump_info
+
+def write_synthetic_triples(file_path, triple_count=1000000, num_ent=100000, num_rel=500, seed=0):
+    #tab separated `head tail relation` ids read by load_triple_dict, heads and tails follow a zipf law like real graphs
+    rng = np.random.default_rng(seed)
+    triples = np.stack([
+        (rng.zipf(1.5, triple_count) - 1) % num_ent,
+        rng.integers(num_ent, size=triple_count),
+        (rng.zipf(2.0, triple_count) - 1) % num_rel,
+    ], axis=1)
+    np.savetxt(os.path.abspath(file_path), triples, fmt='%d', delimiter='\t')
+    return {'file_path': os.path.abspath(file_path), 'lines': triple_count, 'bytes': os.path.getsize(os.path.abspath(file_path)), 'num_ent': num_ent, 'num_rel': num_rel}
+
+def write_synthetic_text(file_path, text_count=20000, vocab_size=50000, sentence_count=3, sentence_length=12, seed=0):
+    #json object of {node id: [sentences]} read by load_text, words follow a zipf law
+    rng = np.random.default_rng(seed)
+    with open(os.path.abspath(file_path), 'w') as text_file:
+        text_file.write('{')
+        for i in range(text_count):
+            words = (rng.zipf(1.3, sentence_count * sentence_length) - 1) % vocab_size
+            sentences = [['W%d' % w for w in words[j:j+sentence_length]] for j in range(0, len(words), sentence_length)]
+            text_file.write('%s%s: %s' % (', ' if i else '', json.dumps('Q%d' % i), json.dumps(sentences)))
+        text_file.write('}')
+    return {'file_path': os.path.abspath(file_path), 'lines': text_count, 'bytes': os.path.getsize(os.path.abspath(file_path))}
+
+def per_call_usecs(func, args, number):
+    return 1e6 * timeit.timeit(lambda: [func(*a) for a in args], number=number) / (number * len(args))
+
+def benchmark_entity_path(entity_count=1000, target_count=100000, number=5, seed=0):
+    #per entity cost of the extractor functions and of the target node membership test
+    rng = random.Random(seed)
+    process_node_information.logger = ManualLogger('benchmark', os.devnull)
+    entities = [(synthetic_entity(i, rng),) for i in range(1, entity_count+1)]
+    results = {
+        'get_node_data': per_call_usecs(get_node_data, entities, number),
+        'get_all_attributes': per_call_usecs(get_all_attributes, entities, number),
+    }
+    targets = ['Q%d' % rng.randint(1, 10 ** 8) for _ in range(target_count)]
+    probes = [('Q%d' % rng.randint(1, 10 ** 8),) for _ in range(1000)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        lookups = {
+            'list': targets,
+            'set': set(targets),
+            'bitmap': IdBitmap.build(os.path.join(tmp_dir, 'targets.bitmap'), targets, 'Q'),
+        }
+        for name, lookup in lookups.items():
+            results['target_lookup_%s' % name] = per_call_usecs(lookup.__contains__, probes, 1 if name == 'list' else number)
+    return results
+
+def run_stage(name, func, setup=None):
+    """runs func(*setup()) in a forked process so that the cpu time and the peak rss are those of the stage alone, the
+    worker processes it spawns included. func returns the lines and decompressed bytes it went through"""
+    ctx = multiprocessing.get_context('fork')
+    reader, writer = ctx.Pipe(duplex=False)
+    def stage():
+        args = setup() if setup is not None else ()
+        start_wall = time.perf_counter()
+        start_self, start_children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+        counts = func(*args)
+        wall = time.perf_counter() - start_wall
+        end_self, end_children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+        writer.send({
+            'wall_secs': wall,
+            'cpu_user_secs': end_self.ru_utime - start_self.ru_utime + end_children.ru_utime - start_children.ru_utime,
+            'cpu_system_secs': end_self.ru_stime - start_self.ru_stime + end_children.ru_stime - start_children.ru_stime,
+            #ru_maxrss is in KiB on linux
+            'peak_rss_mb': max(end_self.ru_maxrss, end_children.ru_maxrss) / 1024.0,
+            'lines': counts.get('lines', 0),
+            'lines_per_sec': counts.get('lines', 0) / wall,
+            'mb_per_sec': counts.get('bytes', 0) / wall / 1e6,
+        })
+    process = ctx.Process(target=stage, name=name)
+    process.start()
+    process.join()
+    if process.exitcode != 0 or not reader.poll():
+        raise RuntimeError('benchmark stage %s failed with exit code %s' % (name, process.exitcode))
+    return reader.recv()
+
+def extractor_stage(dump_info, work_path, thread_count=2, json_backend='auto', languages=('en',)):
+    store_path = os.path.join(os.path.abspath(work_path), 'extract')
+    shutil.rmtree(store_path, ignore_errors=True)
+    os.makedirs(os.path.join(store_path, 'logs'))
+    logger = ManualLogger('benchmark', os.path.join(store_path, 'logs', 'main.log'))
+    process_node_information.logger = logger
+    config = {'thread_count': thread_count,
+              'marker': 1e12,
+              'wikidata_dump_path': dump_info['dump_path'],
+              'log_path': os.path.join(store_path, 'logs'),
+              'store_path': store_path,
+              'target_nodes': set(load_data(logger, dump_info['targets_file'])),
+              'json_backend': json_backend,
+              'languages': list(languages),
+    }
+    extract_node_data_from_dump(logger, config, load_data(logger, dump_info['properties_file']), load_data(logger, dump_info['entities_file']))
+    return {'lines': dump_info['lines'], 'bytes': dump_info['bytes']}
+
+def attributes_stage(dump_info, entity_count=5000):
+    #get_all_attributes on the first decoded entities of the dump, decoding excluded
+    process_node_information.logger = ManualLogger('benchmark', os.devnull)
+    entities = []
+    with bz2.open(dump_info['dump_path'], 'rb') as dump_file:
+        for line in dump_file:
+            line = line.rstrip(b',\n')
+            if line in (b'[', b']'):
+                continue
+            entities.append(json.loads(line))
+            if len(entities) == entity_count:
+                break
+    def run():
+        for entity in entities:
+            get_all_attributes(entity)
+        return {'lines': len(entities)}
+    return run
+
+def sampling_stage(triples_info, batch_size=100000):
+    #the positives and the degree tables are set up before timing, like inside a training loop
+    triples, triple_dict, triple_dict_rev = load_triple_dict(triples_info['file_path'])
+    pos = triples[:batch_size]
+    def run():
+        generate_corrupt_triples(pos, triples_info['num_ent'], triple_dict, triple_dict_rev)
+        return {'lines': len(pos)}
+    return run
+
+def sampler_stage(triples_info, store_path, batch_size=100000):
+    store = open_triple_store(triples_info['file_path'], store_path)
+    sampler = NegativeSampler(store, num_ent=triples_info['num_ent'], seed=0)
+    pos = np.asarray(store.triples[:batch_size])
+    def run():
+        sampler.corrupt(pos)
+        return {'lines': len(pos)}
+    return run
+
+def run_benchmarks(config):
+    #generates the synthetic inputs once, then measures every stage in its own process
+    work_path = os.path.abspath(config['work_path'])
+    dump_info = write_synthetic_dump(os.path.join(work_path, 'data'), config['item_count'], config['property_count'], config['languages'], config['claim_count'], seed=config['seed'])
+    triples_info = write_synthetic_triples(os.path.join(work_path, 'data', 'triples.txt'), config['triple_count'], config['item_count'], config['property_count'], seed=config['seed'])
+    text_info = write_synthetic_text(os.path.join(work_path, 'data', 'text.json'), config['text_count'], seed=config['seed'])
+    store_path = os.path.join(work_path, 'triple-store')
+    shutil.rmtree(store_path, ignore_errors=True)
+    stages = {
+        'extract_node_data': run_stage('extract_node_data', lambda: extractor_stage(dump_info, work_path, config['thread_count'], config['json_backend'], config['languages'])),
+        'get_all_attributes': run_stage('get_all_attributes', lambda run: run(), lambda: (attributes_stage(dump_info),)),
+        'load_triple_dict': run_stage('load_triple_dict', lambda: (load_triple_dict(triples_info['file_path']), triples_info)[1]),
+        'open_triple_store': run_stage('open_triple_store', lambda: (open_triple_store(triples_info['file_path'], store_path), triples_info)[1]),
+        'generate_corrupt_triples': run_stage('generate_corrupt_triples', lambda run: run(), lambda: (sampling_stage(triples_info, config['batch_size']),)),
+        'negative_sampler': run_stage('negative_sampler', lambda run: run(), lambda: (sampler_stage(triples_info, store_path, config['batch_size']),)),
+        'load_text': run_stage('load_text', lambda: (load_text(text_info['file_path'], 1, 100), text_info)[1]),
+    }
+    return {
+        'config': config,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'started_at': datetime.utcnow().isoformat(),
+        'inputs': {'dump': dump_info, 'triples': triples_info, 'text': text_info},
+        'stages': stages,
+        'entity_path_usecs': benchmark_entity_path(),
+    }
+
+def compare_results(results, baseline):
+    #wall time ratio of every stage against a previous run, below 1 is faster
+    return {name: stage['wall_secs'] / baseline['stages'][name]['wall_secs'] for name, stage in results['stages'].items() if name in baseline.get('stages', {})}
+
+if __name__ == "__main__":
+    #usage : python benchmark.py [results.json] [baseline results.json]
+    results_file = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else 'benchmark-results.json')
+    config = {'work_path': os.path.join(tempfile.gettempdir(), 'wikidata-benchmark'),
+              'item_count': 20000,
+              'property_count': 500,
+              'languages': ['en', 'hi', 'bn', 'ta', 'te'],
+              'claim_count': 20,
+              'triple_count': 1000000,
+              'text_count': 20000,
+              'batch_size': 100000,
+              'thread_count': 2,
+              'json_backend': 'auto',
+              'seed': 0,
+    }
+    results = run_benchmarks(config)
+    with open(results_file, 'w') as rf:
+        json.dump(results, rf, indent=1)
+    for name, stage in results['stages'].items():
+        print("%-26s %9.2f secs %9.2f cpu secs %12d lines/sec %8.2f MB/sec %9.1f MB peak rss" % (name, stage['wall_secs'], stage['cpu_user_secs'] + stage['cpu_system_secs'], stage['lines_per_sec'], stage['mb_per_sec'], stage['peak_rss_mb']))
+    for name, usecs in results['entity_path_usecs'].items():
+        print("%-28s %10.3f usecs per entity" % (name, usecs))
+    if len(sys.argv) > 2:
+        with open(os.path.abspath(sys.argv[2])) as bf:
+            for name, ratio in compare_results(results, json.load(bf)).items():
+                print("%-26s %6.2fx wall time of the baseline" % (name, ratio))
+    print("results saved to %s" % results_file)
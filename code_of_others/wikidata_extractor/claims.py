@@ -0,0 +1,74 @@
+#claim layout is documented here: https://www.mediawiki.org/wiki/Wikibase/DataModel/JSON#Claims_and_Statements
+#the default filter keeps the string and monolingualtext attributes of every property and no relations
+DEFAULT_CLAIM_FILTER = {
+    #property ids whose claims are read, None reads all the properties
+    'properties': None,
+    #datatypes of the main snaks kept as attributes of the target nodes
+    'attribute_datatypes': ['string', 'monolingualtext'],
+    #datatypes of the main snaks written as `head property tail` relation triples, e.g. ['wikibase-item']
+    'relation_datatypes': [],
+    #statement ranks which are kept, None keeps all of them, e.g. ['preferred', 'normal']
+    'ranks': None,
+    #qualifiers attached to the attributes: False drops them, True keeps all, a list keeps those properties only
+    'qualifiers': False,
+}
+
+#entity datatypes whose value id is the tail of a relation
+ENTITY_DATATYPES = frozenset(['wikibase-item', 'wikibase-property', 'wikibase-lexeme', 'wikibase-form', 'wikibase-sense'])
+
+
+def format_datavalue(datavalue):
+    #plain string of a snak value, monolingual text is returned as (language, text) so that it can be routed
+    value_type, value = datavalue['type'], datavalue['value']
+    if value_type == 'string':
+        return value
+    if value_type == 'monolingualtext':
+        return value['language'], value['text']
+    if value_type == 'wikibase-entityid':
+        return value['id'] if 'id' in value else '%s%d' % ('P' if value['entity-type'] == 'property' else 'Q', value['numeric-id'])
+    if value_type == 'quantity':
+        return value['amount'] if value.get('unit', '1') == '1' else '%s %s' % (value['amount'], value['unit'].rsplit('/', 1)[-1])
+    if value_type == 'time':
+        return value['time']
+    if value_type == 'globecoordinate':
+        return '%s,%s' % (value['latitude'], value['longitude'])
+    raise ValueError('unknown datavalue type : %s' % value_type)
+
+class ClaimFilter():
+    """declarative claim filter compiled once into sets and a datatype table, so that deciding the fate of a snak
+    costs a few dict and set lookups"""
+    def __init__(self, claim_filter=None):
+        self.config = dict(DEFAULT_CLAIM_FILTER, **(claim_filter or {}))
+        properties = self.config['properties']
+        self.properties = None if properties is None else frozenset(properties)
+        ranks = self.config['ranks']
+        self.ranks = None if ranks is None else frozenset(ranks)
+        #datatype -> 'attribute' or 'relation', a datatype listed in both is kept as a relation
+        self.datatype_kinds = {datatype: 'attribute' for datatype in self.config['attribute_datatypes']}
+        for datatype in self.config['relation_datatypes']:
+            if datatype not in ENTITY_DATATYPES:
+                raise ValueError('relation datatype %s does not point to an entity' % datatype)
+            self.datatype_kinds[datatype] = 'relation'
+        qualifiers = self.config['qualifiers']
+        self.keep_qualifiers = bool(qualifiers)
+        self.qualifier_properties = None if qualifiers is True or not qualifiers else frozenset(qualifiers)
+        self.has_relations = len(self.config['relation_datatypes']) != 0
+
+    def __getstate__(self):
+        return self.config
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+    def qualifiers_of(self, snak):
+        #{property id: [values]} of the value qualifiers kept by the filter
+        qualifiers = {}
+        for property_id, qualifier_snaks in snak.get('qualifiers', {}).items():
+            if self.qualifier_properties is not None and property_id not in self.qualifier_properties:
+                continue
+            for qualifier in qualifier_snaks:
+                if qualifier.get('snaktype', None) != 'value':
+                    continue
+                value = format_datavalue(qualifier['datavalue'])
+                qualifiers.setdefault(property_id, []).append(value[1] if isinstance(value, tuple) else value)
+        return qualifiers
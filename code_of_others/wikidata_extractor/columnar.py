@@ -0,0 +1,129 @@
+import json
+import os
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+#columnar node files hold one row per node of one language, the language is stored in the schema metadata.
+#parquet files are written in row groups of row_group_size rows, arrow ipc files in record batches of that size, so
+#that readers can select columns and row groups, and memory map arrow files without copies
+COLUMNAR_FORMATS = ('parquet', 'arrow')
+DEFAULT_ROW_GROUP_SIZE = 1 << 16
+
+
+def require_pyarrow(output_formats):
+    if pa is None and any(file_format in COLUMNAR_FORMATS for file_format in output_formats):
+        raise ImportError('pyarrow is needed for the columnar output formats %s' % ', '.join(f for f in output_formats if f in COLUMNAR_FORMATS))
+
+def node_schema(lang):
+    #qualifiers are kept as a json string, as their values differ from one property to the other
+    attribute = pa.struct([('property', pa.string()), ('value', pa.string()), ('qualifiers', pa.string())])
+    return pa.schema([
+        ('id', pa.string()),
+        ('label', pa.string()),
+        ('description', pa.string()),
+        ('wikipedia_title', pa.string()),
+        ('aliases', pa.list_(pa.string())),
+        ('attributes', pa.list_(attribute)),
+    ], metadata={'language': lang})
+
+def columnar_file_path(file_path, file_format):
+    #same name as the json file, with the extension of the columnar format
+    return '%s.%s' % (os.path.splitext(file_path)[0], file_format)
+
+class ColumnarWriter():
+    """buffers [node id, info] records like JsonLinesWriter and writes them as a parquet row group or an arrow record
+    batch every row_group_size records"""
+    def __init__(self, file_path, lang='en', file_format='parquet', row_group_size=DEFAULT_ROW_GROUP_SIZE):
+        self.file_path = os.path.abspath(file_path)
+        self.lang = lang
+        self.file_format = file_format
+        self.row_group_size = row_group_size
+        self.schema = node_schema(lang)
+        self.count = 0
+        self.columns = {name: [] for name in self.schema.names}
+        self._writer = open_table_writer(self.file_path, self.schema, file_format)
+
+    def write(self, record):
+        node_id, info = record
+        self.columns['id'].append(node_id)
+        self.columns['label'].append(info.get('%s_label' % self.lang, None))
+        self.columns['description'].append(info.get('%s_desc' % self.lang, None))
+        self.columns['wikipedia_title'].append(info.get('%s_wikipedia_title' % self.lang, None))
+        self.columns['aliases'].append(info.get('aliases', None))
+        attributes = info.get('attributes', None)
+        if attributes is not None:
+            attributes = [{'property': a[0], 'value': a[1], 'qualifiers': json.dumps(a[2]) if len(a) > 2 else None} for a in attributes]
+        self.columns['attributes'].append(attributes)
+        self.count += 1
+        if len(self.columns['id']) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.columns['id']) == 0:
+            return
+        write_table(self._writer, pa.Table.from_pydict(self.columns, schema=self.schema), self.file_format, self.row_group_size)
+        self.columns = {name: [] for name in self.schema.names}
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+def open_table_writer(file_path, schema, file_format):
+    if file_format == 'parquet':
+        return pq.ParquetWriter(file_path, schema)
+    return pa.ipc.new_file(file_path, schema)
+
+def write_table(writer, table, file_format, row_group_size):
+    if file_format == 'parquet':
+        writer.write_table(table, row_group_size=row_group_size)
+    else:
+        for batch in table.to_batches(max_chunksize=row_group_size):
+            writer.write_batch(batch)
+
+def iter_tables(file_path, file_format):
+    #row groups of a parquet file, record batches of an arrow file, as tables
+    if file_format == 'parquet':
+        parquet_file = pq.ParquetFile(file_path)
+        for i in range(parquet_file.num_row_groups):
+            yield parquet_file.read_row_group(i)
+    else:
+        #the batches reference the mapped pages, the map stays open as long as they are alive
+        reader = pa.ipc.open_file(pa.memory_map(file_path))
+        for i in range(reader.num_record_batches):
+            yield pa.Table.from_batches([reader.get_batch(i)])
+
+def merge_columnar_files(logger, range_files, output_file, lang, file_format, row_group_size=DEFAULT_ROW_GROUP_SIZE):
+    """streams the per range files into one file, small row groups of the ranges are combined so that the output is
+    made of full row groups. returns the node ids"""
+    node_ids = set()
+    schema = node_schema(lang)
+    writer = open_table_writer(output_file, schema, file_format)
+    pending, pending_rows = [], 0
+    for range_file in range_files:
+        logger.debug('streaming - %s - row groups from file : %s' % (file_format, range_file))
+        for table in iter_tables(range_file, file_format):
+            node_ids.update(table.column('id').to_pylist())
+            pending.append(table)
+            pending_rows += table.num_rows
+            if pending_rows >= row_group_size:
+                combined = pa.concat_tables(pending).combine_chunks()
+                full_rows = pending_rows - pending_rows % row_group_size
+                write_table(writer, combined.slice(0, full_rows), file_format, row_group_size)
+                pending, pending_rows = [combined.slice(full_rows)], pending_rows - full_rows
+    if pending_rows:
+        write_table(writer, pa.concat_tables(pending).combine_chunks(), file_format, row_group_size)
+    writer.close()
+    return node_ids
+
+def read_node_table(file_path, columns=None, filters=None):
+    """reads the given columns of a columnar node file. parquet row groups are skipped with the filters, e.g.
+    [('id', 'in', ['Q42'])], arrow files are memory mapped and read without copies"""
+    if file_path.endswith('.parquet'):
+        return pq.read_table(file_path, columns=columns, filters=filters, memory_map=True)
+    table = pa.ipc.open_file(pa.memory_map(file_path)).read_all()
+    return table if columns is None else table.select(columns)
@@ -0,0 +1,240 @@
+import bz2
+import multiprocessing
+import os
+import re
+import numpy as np
+
+
+#bzip2 markers are 48 bits long and are not aligned to byte boundaries
+BLOCK_MAGIC = 0x314159265359
+STREAM_END_MAGIC = 0x177245385090
+MAGIC_BITS = 48
+STREAM_HEADER = b'BZh9'
+SCAN_CHUNK_SIZE = 1 << 24
+SCAN_OVERLAP = 16
+MAX_BLOCK_MERGE = 2
+DEFAULT_CHUNK_BLOCKS = 256
+#the top level id is the first id of every entity line
+ENTITY_ID_PATTERN = re.compile(rb'"id": ?"([^"]*)"')
+
+
+def _magic_patterns(magic):
+    #for every bit shift inside a byte, the bytes of the marker which are fully determined
+    patterns = []
+    full_mask = (1 << MAGIC_BITS) - 1
+    for shift in range(8):
+        window = (magic << (8 - shift)).to_bytes(7, 'big')
+        mask = (full_mask << (8 - shift)).to_bytes(7, 'big')
+        lo = 0 if mask[0] == 0xff else 1
+        patterns.append((shift, window[lo:6], lo, int.from_bytes(window, 'big'), int.from_bytes(mask, 'big')))
+    return patterns
+
+def _iter_markers(fh, start=0, chunk_size=SCAN_CHUNK_SIZE):
+    #yields (bit offset, is block marker, block crc) of every marker found at or after byte `start`
+    patterns = [(p, True) for p in _magic_patterns(BLOCK_MAGIC)]
+    patterns += [(p, False) for p in _magic_patterns(STREAM_END_MAGIC)]
+    position = start
+    while True:
+        fh.seek(position)
+        buf = fh.read(chunk_size + SCAN_OVERLAP)
+        if not buf:
+            return
+        limit = min(chunk_size, len(buf))
+        hits = []
+        for (shift, fixed, lo, window, mask), is_block in patterns:
+            idx = buf.find(fixed)
+            while idx != -1:
+                begin = idx - lo
+                if 0 <= begin < limit and int.from_bytes(buf[begin:begin + 7], 'big') & mask == window:
+                    #the 32 bit block crc directly follows the marker
+                    crc = (int.from_bytes(buf[begin:begin + 11], 'big') >> (8 - shift)) & 0xffffffff
+                    hits.append(((position + begin) * 8 + shift, is_block, crc))
+                idx = buf.find(fixed, idx + 1)
+        hits.sort()
+        yield from hits
+        if len(buf) <= chunk_size:
+            return
+        position += limit
+
+def scan_blocks(fh, start=0):
+    #yields (start bit, end bit, crc) of every compressed block starting at or after byte `start`
+    current = None
+    for bit, is_block, crc in _iter_markers(fh, start):
+        if current is not None:
+            yield current[0], bit, current[1]
+        current = (bit, crc) if is_block else None
+
+def decompress_block(fh, block):
+    #wraps the bits of a single block into a standalone bzip2 stream and decompresses it
+    start_bit, end_bit, crc = block
+    first, last = start_bit // 8, (end_bit + 7) // 8
+    fh.seek(first)
+    raw = fh.read(last - first)
+    nbits = end_bit - start_bit
+    value = int.from_bytes(raw, 'big') >> (len(raw) * 8 - (end_bit - first * 8))
+    value &= (1 << nbits) - 1
+    #a stream holding one block has the block crc as its combined crc
+    value = (value << 80) | (STREAM_END_MAGIC << 32) | crc
+    nbits += 80
+    padding = -nbits % 8
+    return bz2.decompress(STREAM_HEADER + (value << padding).to_bytes((nbits + padding) // 8, 'big'))
+
+def iter_block_data(fh, blocks, mid_stream=False):
+    #a marker can occur by chance inside compressed data, such a candidate is merged into its predecessor. only the
+    #first candidate of a range starting mid stream may be such a marker without a predecessor, its bits are decoded
+    #by the preceding range which also reads that block to finish its last line. any other candidate which cannot be
+    #decoded is a corrupted block
+    blocks = iter(blocks)
+    lookahead = []
+    first = mid_stream
+    while True:
+        block = lookahead.pop(0) if lookahead else next(blocks, None)
+        if block is None:
+            return
+        merged, data = block, None
+        for attempt in range(MAX_BLOCK_MERGE + 1):
+            try:
+                data = decompress_block(fh, merged)
+                break
+            except (OSError, EOFError, ValueError):
+                if attempt == MAX_BLOCK_MERGE:
+                    break
+                if len(lookahead) <= attempt:
+                    following = next(blocks, None)
+                    if following is None:
+                        break
+                    lookahead.append(following)
+                merged = (block[0], lookahead[attempt][1], block[2])
+        if data is None:
+            if not first:
+                raise OSError('unable to decode the bz2 block starting at bit %d' % block[0])
+            #false marker, its bits are decoded together with the preceding block
+            first = False
+            continue
+        first = False
+        del lookahead[:attempt]
+        yield merged, data
+
+def read_range_lines(path, start=0, end=None, blocks=None):
+    #yields the raw lines owned by the compressed byte range [start, end) of the dump. a line belongs to the
+    #range where it starts, so a range skips its leading partial line and reads past its end to finish the last one
+    with open(os.path.abspath(path), 'rb') as fh:
+        if end is None:
+            end = os.fstat(fh.fileno()).st_size
+        if blocks is None:
+            blocks = scan_blocks(fh, start)
+        else:
+            #index blocks are an (n, 3) array shared by the forked workers, rows are only converted when read
+            index_blocks, first = blocks, int(np.searchsorted(blocks[:, 0], np.uint64(start * 8)))
+            blocks = (tuple(index_blocks[i].tolist()) for i in range(first, len(index_blocks)))
+        skip = start > 0
+        def owned_blocks():
+            #a block past the end is only decompressed to finish the last line, a range still skipping its leading
+            #partial line owns no line and stops before decompressing it
+            for block in blocks:
+                if skip and block[0] >= end * 8:
+                    return
+                yield block
+        partial = b''
+        for block, data in iter_block_data(fh, owned_blocks(), mid_stream=start > 0):
+            if block[0] >= end * 8:
+                if skip:
+                    return
+                idx = data.find(b'\n')
+                if idx == -1:
+                    partial += data
+                    continue
+                yield partial + data[:idx]
+                return
+            if skip:
+                idx = data.find(b'\n')
+                if idx == -1:
+                    continue
+                data = data[idx + 1:]
+                skip = False
+            lines = (partial + data).split(b'\n')
+            partial = lines.pop()
+            yield from lines
+        if partial and not skip:
+            yield partial
+
+def split_ranges(path, parts):
+    #splits the compressed dump into `parts` disjoint byte ranges
+    size = os.path.getsize(os.path.abspath(path))
+    return [(i * size // parts, (i + 1) * size // parts) for i in range(parts)]
+
+def line_entity_id(line):
+    #reads the entity id of a raw dump line without parsing it
+    match = ENTITY_ID_PATTERN.search(line)
+    if match is None:
+        return None
+    return match.group(1).decode('ascii', 'replace')
+
+def chunk_byte_range(blocks, first, last, size):
+    #compressed byte range owned by the chunk made of blocks [first, last)
+    start = 0 if first == 0 else int(blocks[first][0]) // 8
+    end = size if last >= len(blocks) else int(blocks[last][0]) // 8
+    return start, end
+
+_index_blocks = None
+
+def _set_index_blocks(blocks):
+    global _index_blocks
+    _index_blocks = blocks
+
+def _chunk_id_range(path, start, end):
+    #min and max numeric ids of the items and properties starting in a chunk, -1 when absent
+    bounds = {'Q': [-1, -1], 'P': [-1, -1]}
+    for line in read_range_lines(path, start, end, _index_blocks):
+        entity_id = line_entity_id(line)
+        if entity_id is None or entity_id[:1] not in bounds or not entity_id[1:].isdigit():
+            continue
+        number, bound = int(entity_id[1:]), bounds[entity_id[0]]
+        bound[0] = number if bound[0] == -1 else min(bound[0], number)
+        bound[1] = max(bound[1], number)
+    return bounds['Q'] + bounds['P']
+
+def build_dump_index(path, index_path, chunk_blocks=DEFAULT_CHUNK_BLOCKS, processes=1):
+    #one time pass recording the compressed blocks of the dump and the entity id ranges of each chunk of blocks
+    path = os.path.abspath(path)
+    with open(path, 'rb') as fh:
+        blocks = np.array(list(scan_blocks(fh)), dtype=np.uint64).reshape(-1, 3)
+    stat = os.stat(path)
+    chunks = []
+    for first in range(0, len(blocks), chunk_blocks):
+        last = min(first + chunk_blocks, len(blocks))
+        chunks.append([first, last] + list(chunk_byte_range(blocks, first, last, stat.st_size)))
+    with multiprocessing.Pool(processes, initializer=_set_index_blocks, initargs=(blocks,)) as pool:
+        id_ranges = pool.starmap(_chunk_id_range, [(path, chunk[2], chunk[3]) for chunk in chunks])
+    with open(os.path.abspath(index_path), 'wb') as index_file:
+        np.savez(index_file,
+                 source=np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64),
+                 blocks=blocks,
+                 chunks=np.array([c + r for c, r in zip(chunks, id_ranges)], dtype=np.int64).reshape(-1, 8))
+
+def dump_index_is_current(path, index_path):
+    if not os.path.exists(os.path.abspath(index_path)):
+        return False
+    stat = os.stat(os.path.abspath(path))
+    with np.load(os.path.abspath(index_path)) as index:
+        return index['source'].tolist() == [stat.st_size, stat.st_mtime_ns]
+
+def load_dump_index(index_path):
+    #blocks are an (n, 3) uint64 array of (start bit, end bit, crc) rows, kept as an array so that the forked workers
+    #share its pages. chunks are (first block, last block, start byte, end byte, min item, max item, min property, max property)
+    with np.load(os.path.abspath(index_path)) as index:
+        return {
+            'blocks': index['blocks'],
+            'chunks': [tuple(chunk) for chunk in index['chunks'].tolist()],
+        }
+
+def select_chunks(dump_index, item_numbers, property_numbers):
+    #chunk ids whose item or property id range holds at least one of the requested numeric ids
+    numbers = {'Q': np.unique(item_numbers), 'P': np.unique(property_numbers)}
+    def overlaps(prefix, lo, hi):
+        if lo == -1:
+            return False
+        pos = np.searchsorted(numbers[prefix], lo)
+        return pos < len(numbers[prefix]) and numbers[prefix][pos] <= hi
+    return [chunk_id for chunk_id, chunk in enumerate(dump_index['chunks'])
+            if overlaps('Q', chunk[4], chunk[5]) or overlaps('P', chunk[6], chunk[7])]
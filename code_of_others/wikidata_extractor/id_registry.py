@@ -0,0 +1,204 @@
+import hashlib
+import mmap
+import os
+import struct
+from collections.abc import Mapping
+import numpy as np
+
+
+def string_hash(key):
+    #stable 64 bit hash of a byte string, the same in every process and run
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+class IdRegistry(Mapping):
+    """append-only mapping of node ids (wikidata ids) to int ids starting at 1. an assigned id never changes, new
+    strings get the next ids. the registry is made of raw files next to file_path:
+        .strings    utf-8 strings of all the ids, concatenated in id order
+        .ends       int64 end offset of every string, the string of id i is strings[ends[i-2]:ends[i-1]]
+        .hashes     uint64 hash of every string
+        .slots      open addressing hash table of ids (0 is an empty slot) with linear probing
+    all of them are memory mapped, so both lookups are O(1) without loading the registry. .ends is written last when
+    appending, a table whose header count does not match it is rebuilt from the hashes. there must be only one writer"""
+    HEADER = struct.Struct('<4sQQ')
+    MAGIC = b'IDRG'
+    MAX_LOAD = 0.5
+    MIN_CAPACITY = 1 << 10
+
+    def __init__(self, file_path):
+        self.file_path = os.path.abspath(file_path)
+        for suffix in ['strings', 'ends', 'hashes']:
+            if not os.path.exists(self._path(suffix)):
+                open(self._path(suffix), 'wb').close()
+        self._load()
+
+    def _path(self, suffix):
+        return '%s.%s' % (self.file_path, suffix)
+
+    def _map_array(self, suffix, dtype):
+        if os.path.getsize(self._path(suffix)) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self._path(suffix), dtype=dtype, mode='r')
+
+    def _load(self):
+        self.ends = self._map_array('ends', np.int64)
+        self.count = len(self.ends)
+        self.hashes = self._map_array('hashes', np.uint64)[:self.count]
+        if os.path.getsize(self._path('strings')) == 0:
+            self._strings = b''
+        else:
+            with open(self._path('strings'), 'rb') as strings_file:
+                self._strings = mmap.mmap(strings_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._open_slots()
+
+    def _open_slots(self):
+        if os.path.exists(self._path('slots')):
+            with open(self._path('slots'), 'rb') as slots_file:
+                magic, capacity, count = self.HEADER.unpack(slots_file.read(self.HEADER.size))
+            if magic == self.MAGIC and count == self.count and self.count <= self.MAX_LOAD * capacity:
+                self.capacity = capacity
+                self.slots = np.memmap(self._path('slots'), dtype=np.int64, mode='r+', offset=self.HEADER.size, shape=(capacity,))
+                return
+        capacity = self.MIN_CAPACITY
+        while self.count > self.MAX_LOAD * capacity:
+            capacity *= 2
+        self._rebuild_slots(capacity)
+
+    def _rebuild_slots(self, capacity):
+        #vectorized linear probing: at every round the pending ids try their next slot and, among the ids aiming at
+        #the same free slot, the first one takes it. a slot is never freed, so every id is found by a probe from home
+        slots = np.zeros(capacity, dtype=np.int64)
+        home = (self.hashes & np.uint64(capacity - 1)).astype(np.int64)
+        pending, step = np.arange(self.count, dtype=np.int64), 0
+        while len(pending):
+            position = (home[pending] + step) & (capacity - 1)
+            free = np.flatnonzero(slots[position] == 0)
+            _, first = np.unique(position[free], return_index=True)
+            winners = free[first]
+            slots[position[winners]] = pending[winners] + 1
+            placed = np.zeros(len(pending), dtype=bool)
+            placed[winners] = True
+            pending, step = pending[~placed], step + 1
+        with open(self._path('slots') + '.tmp', 'wb') as slots_file:
+            slots_file.write(self.HEADER.pack(self.MAGIC, capacity, self.count))
+            slots_file.write(slots.tobytes())
+        os.replace(self._path('slots') + '.tmp', self._path('slots'))
+        self.capacity = capacity
+        self.slots = np.memmap(self._path('slots'), dtype=np.int64, mode='r+', offset=self.HEADER.size, shape=(capacity,))
+
+    def bytes_of(self, item_id):
+        start = int(self.ends[item_id - 2]) if item_id > 1 else 0
+        return self._strings[start:int(self.ends[item_id - 1])]
+
+    def string_of(self, item_id):
+        if not 0 < item_id <= self.count:
+            raise KeyError(item_id)
+        return self.bytes_of(item_id).decode('utf-8')
+
+    def _find(self, key, key_hash):
+        mask = self.capacity - 1
+        slot = key_hash & mask
+        while True:
+            item_id = int(self.slots[slot])
+            if item_id == 0:
+                return 0, slot
+            if int(self.hashes[item_id - 1]) == key_hash and self.bytes_of(item_id) == key:
+                return item_id, slot
+            slot = (slot + 1) & mask
+
+    def __getitem__(self, string):
+        if not isinstance(string, str):
+            raise KeyError(string)
+        key = string.encode('utf-8')
+        item_id, _ = self._find(key, string_hash(key))
+        if item_id == 0:
+            raise KeyError(string)
+        return item_id
+
+    def __iter__(self):
+        for item_id in range(1, self.count + 1):
+            yield self.bytes_of(item_id).decode('utf-8')
+
+    def __len__(self):
+        return self.count
+
+    def values(self):
+        #ids in the iteration order of the strings, without hash lookups
+        return range(1, self.count + 1)
+
+    def add(self, strings):
+        #ids of the strings, the unknown ones are appended in order and get the next free ids
+        ids, new = [], {}
+        for string in strings:
+            item_id = self.get(string, None) or new.get(string, None)
+            if item_id is None:
+                item_id = new[string] = self.count + len(new) + 1
+            ids.append(item_id)
+        if new:
+            self._append([string.encode('utf-8') for string in new])
+        return ids
+
+    def _append(self, keys):
+        first_id = self.count + 1
+        start = int(self.ends[-1]) if self.count else 0
+        ends = start + np.cumsum(np.array([len(key) for key in keys], dtype=np.int64))
+        hashes = np.array([string_hash(key) for key in keys], dtype=np.uint64)
+        #bytes left behind by an interrupted append are dropped first
+        os.truncate(self._path('strings'), start)
+        os.truncate(self._path('hashes'), 8 * self.count)
+        with open(self._path('strings'), 'ab') as strings_file:
+            strings_file.write(b''.join(keys))
+        with open(self._path('hashes'), 'ab') as hashes_file:
+            hashes_file.write(hashes.tobytes())
+        #the new ids exist once their ends are written
+        with open(self._path('ends'), 'ab') as ends_file:
+            ends_file.write(ends.tobytes())
+        slots, capacity = self.slots, self.capacity
+        self.ends = self._map_array('ends', np.int64)
+        self.count = len(self.ends)
+        self.hashes = self._map_array('hashes', np.uint64)[:self.count]
+        with open(self._path('strings'), 'rb') as strings_file:
+            self._strings = mmap.mmap(strings_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.count > self.MAX_LOAD * capacity:
+            self._open_slots()
+            return
+        for item_id, key, key_hash in zip(range(first_id, self.count + 1), keys, hashes.tolist()):
+            _, slot = self._find(key, key_hash)
+            slots[slot] = item_id
+        slots.flush()
+        with open(self._path('slots'), 'r+b') as slots_file:
+            slots_file.write(self.HEADER.pack(self.MAGIC, capacity, self.count))
+
+def open_id_registry(logger, registry_path, map_file=None):
+    #a new registry is seeded from the `id node` map file of a previous run, so that its ids are kept
+    registry = IdRegistry(registry_path)
+    if len(registry) == 0 and map_file is not None and os.path.exists(os.path.abspath(map_file)):
+        pairs = []
+        with open(os.path.abspath(map_file), 'r') as mf:
+            for line in mf:
+                idd, node = line.split()
+                pairs.append((int(idd), node))
+        pairs.sort()
+        if [idd for idd, _ in pairs] != list(range(1, len(pairs) + 1)):
+            raise ValueError('ids of map file %s are not numbered from 1 without gaps' % map_file)
+        registry.add([node for _, node in pairs])
+        logger.info(' seeded id registry %s with %d ids of map file : %s' % (registry_path, len(registry), map_file))
+    return registry
+
+def update_id_mapping(logger, registry_path, map_file, node_ids):
+    """registers the node ids which are still unknown, in sorted order, and appends them to the `id node` map file.
+    ids of known nodes never change, even when they are no longer extracted. returns the registry"""
+    registry = open_id_registry(logger, registry_path, map_file)
+    previous_count = len(registry)
+    new_nodes = sorted(set(node for node in (str(n).strip() for n in node_ids) if len(node)!=0 and node not in registry))
+    registry.add(new_nodes)
+    #the map file is rewritten only when it does not match the registry, otherwise the new lines are appended
+    map_count = 0
+    if os.path.exists(os.path.abspath(map_file)):
+        with open(os.path.abspath(map_file), 'r') as mf:
+            map_count = sum(1 for _ in mf)
+    first_id = previous_count + 1 if map_count == previous_count else 1
+    with open(os.path.abspath(map_file), 'a' if first_id > 1 else 'w') as mf:
+        for item_id in range(first_id, len(registry) + 1):
+            mf.write("%d %s\n" % (item_id, registry.string_of(item_id)))
+    logger.info(' %d new ids registered in %s, %d ids in total' % (len(new_nodes), registry_path, len(registry)))
+    return registry
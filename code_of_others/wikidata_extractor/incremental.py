@@ -0,0 +1,249 @@
+import os
+import bz2
+import gzip
+import json
+import shutil
+from utils import *
+import process_node_information
+from process_node_information import extract_node, extract_node_data_from_dump, language_node_type, store_scanned_ids
+from claims import ClaimFilter
+from columnar import COLUMNAR_FORMATS
+from id_registry import update_id_mapping
+
+
+#an incremental run starts from the output of a previous run in store_path: the {}-info.txt files of every language,
+#triples.txt when relations are extracted, the {}-scanned.bitmap requested ids whose dump records were read, and the
+#{}-registry id registries or {}-map.txt files. the changed entities
+#are read from change feeds, json lines files (optionally .bz2 or .gz) holding one entity document per line in the dump
+#layout, or a deletion record {"id": "Q42", "deleted": true}. a later record of an id replaces the earlier ones
+
+
+def iter_change_records(logger, change_files, json_loads, fields):
+    for change_file in change_files:
+        change_file = os.path.abspath(change_file)
+        opener = bz2.open if change_file.endswith('.bz2') else gzip.open if change_file.endswith('.gz') else open
+        logger.info(' reading change feed : %s' % change_file)
+        with opener(change_file, 'rb') as cf:
+            for line in cf:
+                #lines of an incremental json dump carry the same array brackets and trailing commas as the full dump
+                line = line.strip().rstrip(b',')
+                if line in (b'', b'[', b']'):
+                    continue
+                try:
+                    yield json_loads(line, fields)
+                except ValueError as e:
+                    logger.error(' unable to parse change record %s. original exception: %s' % (line[:100], str(e)))
+
+def collect_changes(logger, config, change_files, entities, properties, target_nodes):
+    """extracts every change record like the workers do. returns {(node type, lang): {id: info or None}}, None meaning
+    that the node lost its data in that language, the {head: relations} of the changed entities, the new attribute
+    properties and the deleted ids"""
+    languages = config.get('languages', ['en'])
+    claim_filter = ClaimFilter(config.get('claim_filter', None))
+    json_backend, json_loads = get_json_loader(config.get('json_backend', 'auto'))
+    fields = get_attribute_fields(languages) + [['deleted']]
+    changes = {(node_type, lang): {} for node_type in ['entities', 'properties'] for lang in languages}
+    relations, new_attributes, deleted = {}, set(), set()
+    record_count = 0
+    for data in iter_change_records(logger, change_files, json_loads, fields):
+        record_count+=1
+        if data.get('deleted', False):
+            node_id = clean_str(data.get('id', ''))
+            node_type = 'properties' if node_id[:1] == 'P' else 'entities'
+            for lang in languages:
+                changes[(node_type, lang)][node_id] = None
+            relations[node_id] = []
+            deleted.add(node_id)
+            continue
+        node_type, entity_id, results, node_attributes, node_relations = extract_node(data, entities, properties, target_nodes, languages, claim_filter)
+        if node_type is None:
+            continue
+        for lang, (status, info) in results.items():
+            changes[(node_type, lang)][entity_id] = info if status else None
+        for attributes in node_attributes:
+            if attributes not in properties:
+                new_attributes.add(attributes)
+        if claim_filter.has_relations and node_type == 'entities':
+            relations[entity_id] = [(head, relation, tail) for head, relation, tail in node_relations if tail in entities or tail in properties]
+    logger.info(' read %d change records with %s json backend, %d deletions, %d changed entities and %d changed properties' % (
+        record_count, json_backend, len(deleted), len(changes[('entities', languages[0])]), len(changes[('properties', languages[0])])))
+    return changes, relations, new_attributes, deleted
+
+def read_node_ids(info_file):
+    #ids of a previous {}-info.txt json object, the values are decoded but not kept
+    if not os.path.exists(info_file):
+        return set()
+    return set(node_id for node_id, _ in iter_json_object_items(info_file))
+
+def read_scanned_ids(scanned_file, info_file):
+    #requested ids of the previous run, outputs written before the scanned bitmaps existed fall back to their info ids
+    if os.path.exists(scanned_file):
+        return IdBitmap(scanned_file)
+    return read_node_ids(info_file)
+
+def scan_missing_nodes(logger, config, missing_entities, missing_properties, entities, properties, target_nodes, changes, relations):
+    #requested nodes found neither in the previous output nor in the change feeds are read from the dump chunks that
+    #hold them, which needs the dump index
+    scan_path = os.path.join(os.path.abspath(config.get('store_path')), 'incremental-scan')
+    shutil.rmtree(scan_path, ignore_errors=True)
+    os.makedirs(scan_path)
+    #relations of the missing nodes may point to any requested node
+    scan_config = dict(config, store_path=scan_path, resume=False, target_nodes=target_nodes, tail_entities=entities, tail_properties=properties)
+    extract_node_data_from_dump(logger, scan_config, sorted(missing_properties), sorted(missing_entities))
+    for (node_type, lang), node_changes in changes.items():
+        info_file = os.path.join(scan_path, '%s-info.txt' % language_node_type(node_type, lang))
+        for node_id, info in iter_json_object_items(info_file):
+            node_changes[node_id] = info
+    if os.path.exists(os.path.join(scan_path, 'triples.txt')):
+        with open(os.path.join(scan_path, 'triples.txt'), 'r') as triples_file:
+            for line in triples_file:
+                head, relation, tail = line.split()
+                relations.setdefault(head, []).append((head, relation, tail))
+
+def rewrite_info_file(info_file, node_ids, node_changes):
+    """streams the previous json object into its replacement: nodes no longer requested are dropped, changed nodes are
+    replaced in place and new nodes are appended. returns the ids written"""
+    written = set()
+    tmp_file = '%s.tmp' % info_file
+    with open(tmp_file, 'w') as data_file:
+        data_file.write('{')
+        def write(node_id, info):
+            data_file.write('%s%s: %s' % (', ' if written else '', json.dumps(node_id), json.dumps(info)))
+            written.add(node_id)
+        if os.path.exists(info_file):
+            for node_id, info in iter_json_object_items(info_file):
+                if node_id in node_changes:
+                    info = node_changes[node_id]
+                if info is None or node_id not in node_ids:
+                    continue
+                write(node_id, info)
+        for node_id, info in node_changes.items():
+            if info is not None and node_id not in written and node_id in node_ids:
+                write(node_id, info)
+        data_file.write('}')
+    os.replace(tmp_file, info_file)
+    return written
+
+def rewrite_triples_file(triples_file, entities, properties, relations):
+    #the relations of the changed or deleted heads replace their previous ones, relations of nodes no longer requested
+    #are dropped. like in a full extraction, a requested tail is kept even when it has no data
+    kept = lambda node_id: node_id in entities or node_id in properties
+    tmp_file = '%s.tmp' % triples_file
+    count = 0
+    with open(tmp_file, 'w') as new_file:
+        if os.path.exists(triples_file):
+            with open(triples_file, 'r') as old_file:
+                for line in old_file:
+                    head, _, tail = line.split()
+                    if head in relations or not kept(head) or not kept(tail):
+                        continue
+                    new_file.write(line)
+                    count+=1
+        for head, head_relations in relations.items():
+            if not kept(head):
+                continue
+            for triple in head_relations:
+                new_file.write("%s %s %s\n" % triple)
+                count+=1
+    os.replace(tmp_file, triples_file)
+    return count
+
+def update_node_data(logger, config, properties, entities, change_files):
+    """incremental counterpart of extract_node_data_from_dump: the previous output in store_path is updated with the
+    change feeds instead of scanning the whole dump. returns the extracted entity and property ids"""
+    start_time = datetime.utcnow()
+    store_path = os.path.abspath(config.get('store_path'))
+    languages = config.get('languages', ['en'])
+    id_file_path = os.path.join(store_path, "{}-ids.bitmap")
+    entities = as_id_bitmap(id_file_path.format('entities'), entities, 'Q')
+    properties = as_id_bitmap(id_file_path.format('properties'), properties, 'P')
+    target_nodes = as_id_bitmap(id_file_path.format('targets'), config.get('target_nodes'), 'Q')
+
+    if any(file_format in COLUMNAR_FORMATS for file_format in config.get('output_formats', ['json'])):
+        logger.warn(' only the json info files are updated, the columnar outputs need a full extraction')
+    changes, relations, new_attributes, _ = collect_changes(logger, config, change_files, entities, properties, target_nodes)
+
+    file_path = os.path.join(store_path, "{}-info.txt")
+    #nodes newly added to the requested sets were never read from the dump, unless a change feed holds them. nodes
+    #scanned before are known even when they have no data in the first language
+    scanned_path = os.path.join(store_path, "{}-scanned.bitmap")
+    scanned_entities = read_scanned_ids(scanned_path.format('entities'), file_path.format(language_node_type('entities', languages[0])))
+    scanned_properties = read_scanned_ids(scanned_path.format('properties'), file_path.format(language_node_type('properties', languages[0])))
+    changed_entities, changed_properties = changes[('entities', languages[0])], changes[('properties', languages[0])]
+    missing_entities = [node_id for node_id in entities if node_id not in scanned_entities and node_id not in changed_entities]
+    missing_properties = [node_id for node_id in properties if node_id not in scanned_properties and node_id not in changed_properties]
+    unscanned_entities, unscanned_properties = set(), set()
+    if (missing_entities or missing_properties) and config.get('dump_index_path', None) is not None:
+        logger.info(' reading %d missing entities and %d missing properties from the indexed dump' % (len(missing_entities), len(missing_properties)))
+        scan_missing_nodes(logger, config, missing_entities, missing_properties, entities, properties, target_nodes, changes, relations)
+    elif missing_entities or missing_properties:
+        logger.warn(' %d requested entities and %d requested properties have no data, set dump_index_path to read them from the dump' % (len(missing_entities), len(missing_properties)))
+        #they are looked up again by the next run
+        unscanned_entities, unscanned_properties = set(missing_entities), set(missing_properties)
+
+    extracted_ids = {}
+    for lang in languages:
+        for node_type, node_ids in [('properties', properties), ('entities', entities)]:
+            info_file = file_path.format(language_node_type(node_type, lang))
+            extracted_ids[(node_type, lang)] = rewrite_info_file(info_file, node_ids, changes[(node_type, lang)])
+            logger.info(" updated %d changed %s in file : %s" % (len(changes[(node_type, lang)]), node_type, info_file))
+
+    if ClaimFilter(config.get('claim_filter', None)).has_relations:
+        triples_file = os.path.join(store_path, "triples.txt")
+        count = rewrite_triples_file(triples_file, entities, properties, relations)
+        logger.info(" updated relations of %d heads, %d relation triples in file : %s" % (len(relations), count, triples_file))
+    if len(new_attributes)!=0:
+        with open(os.path.join(store_path, "incremental-attributes.txt"), 'w') as af:
+            for attribute in new_attributes:
+                af.write("%s\n"%attribute)
+
+    store_scanned_ids(store_path, 'entities', entities, 'Q', unscanned_entities)
+    store_scanned_ids(store_path, 'properties', properties, 'P', unscanned_properties)
+    global_entities, global_properties = extracted_ids[('entities', languages[0])], extracted_ids[('properties', languages[0])]
+    time_delta = (datetime.utcnow() - start_time).total_seconds()
+    logger.info(' total node infromation updated for %d/%d entities, %d/%d properties in %f secs' % (len(global_entities), len(entities), len(global_properties), len(properties), time_delta))
+    return global_entities, global_properties
+
+if __name__ == "__main__":
+    start_time = datetime.utcnow()
+    log_file = os.path.abspath("/scratch/tabhishek/wikidata/next_process/logs/incremental.log")
+    source_folder = os.path.abspath("/scratch/tabhishek/wikidata/data")
+    store_path = os.path.abspath("/scratch/tabhishek/wikidata/next_process/data")
+    target_nodes_file = os.path.abspath("/home/tushar.abhishek/ire/research/wikidata/source_nodes.txt")
+    change_files = [os.path.abspath("/scratch/tabhishek/wikidata/changes/changes.jsonl.bz2")]
+
+    logger = ManualLogger('main', log_file, use_stdout=True)
+    process_node_information.logger = logger
+
+    target_nodes = set()
+    logger.info('loading source nodes from file : %s' %(os.path.abspath(target_nodes_file)))
+    with open(os.path.abspath(target_nodes_file), 'r') as source_file:
+        for line in source_file:
+            target_nodes.add(clean_str(line))
+
+    entities = load_data(logger, os.path.join(source_folder, 'entities.txt'))
+    properties = load_data(logger, os.path.join(source_folder, 'properties.txt'))
+
+    config = {'thread_count': 2,
+                'marker': 1e6,
+                'wikidata_dump_path': "/scratch/tabhishek/wikidata/latest-all.json.bz2",
+                'dump_index_path': "/scratch/tabhishek/wikidata/latest-all.index.npz",
+                'log_path': "/scratch/tabhishek/wikidata/next_process/logs",
+                'store_path': store_path,
+                'target_nodes': target_nodes,
+                'claim_filter': {'relation_datatypes': ['wikibase-item']},
+    }
+
+    entities_info, properties_info = update_node_data(logger, config, properties, entities, change_files)
+
+    mapping_file_path = os.path.join(store_path, "{}-map.txt")
+    registry_path = os.path.join(store_path, "{}-registry")
+    entities_to_id = update_id_mapping(logger, registry_path.format('entities'), mapping_file_path.format('entities'), entities_info)
+    properties_to_id = update_id_mapping(logger, registry_path.format('properties'), mapping_file_path.format('properties'), properties_info)
+
+    stats = update_coded_triples(logger, os.path.join(store_path, 'triples.txt'), os.path.join(store_path, "coded-triples.txt"), entities_to_id, properties_to_id,
+                                 os.path.join(store_path, "coded-triples.npy"))
+    logger.info(' %d coded triples kept, %d added and %d removed' % (stats['kept'], stats['added'], stats['removed']))
+
+    time_delta = (datetime.utcnow() - start_time).total_seconds()
+    logger.info("complete the whole incremental process in %s" % time_delta)
@@ -0,0 +1,122 @@
+import bisect
+import cProfile
+import glob
+import json
+import os
+import pstats
+
+
+#upper bounds in seconds of the stage duration histograms, the last bucket is unbounded
+HISTOGRAM_BOUNDS = (1e-6, 4e-6, 16e-6, 64e-6, 256e-6, 1e-3, 4e-3, 16e-3, 64e-3, 0.25, 1.0)
+METRIC_PREFIX = 'wikidata_extractor'
+
+
+class StageMetrics():
+    """timing counters and duration histograms per stage of a worker. snapshots are plain dicts, so that they can be
+    sent to the parent process and merged there"""
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, secs):
+        entry = self.stages.get(stage, None)
+        if entry is None:
+            entry = self.stages[stage] = [0, 0.0, [0] * (len(HISTOGRAM_BOUNDS) + 1)]
+        entry[0] += 1
+        entry[1] += secs
+        entry[2][bisect.bisect_left(HISTOGRAM_BOUNDS, secs)] += 1
+
+    def snapshot(self):
+        return {stage: {'count': count, 'secs': secs, 'buckets': list(buckets)} for stage, (count, secs, buckets) in self.stages.items()}
+
+    def summary(self):
+        return ', '.join('%s %.1f secs' % (stage, secs) for stage, (_, secs, _) in self.stages.items())
+
+def merge_snapshots(snapshots):
+    #sums the stage snapshots of several workers
+    merged = {}
+    for snapshot in snapshots:
+        for stage, entry in snapshot.items():
+            total = merged.setdefault(stage, {'count': 0, 'secs': 0.0, 'buckets': [0] * len(entry['buckets'])})
+            total['count'] += entry['count']
+            total['secs'] += entry['secs']
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], entry['buckets'])]
+    return merged
+
+def prometheus_text(metrics):
+    #prometheus text exposition of a metrics report, for the node exporter textfile collector
+    lines = [
+        '# HELP %s_stage_seconds time spent per record in every stage of the extraction' % METRIC_PREFIX,
+        '# TYPE %s_stage_seconds histogram' % METRIC_PREFIX,
+    ]
+    stage_sets = sorted(metrics['workers'].items()) + [('all', {'stages': metrics['stages']})]
+    for worker, worker_metrics in stage_sets:
+        for stage, entry in sorted(worker_metrics['stages'].items()):
+            labels = 'worker="%s",stage="%s"' % (worker, stage)
+            cumulative = 0
+            for bound, count in zip(list(HISTOGRAM_BOUNDS) + ['+Inf'], entry['buckets']):
+                cumulative += count
+                lines.append('%s_stage_seconds_bucket{%s,le="%s"} %d' % (METRIC_PREFIX, labels, bound, cumulative))
+            lines.append('%s_stage_seconds_sum{%s} %f' % (METRIC_PREFIX, labels, entry['secs']))
+            lines.append('%s_stage_seconds_count{%s} %d' % (METRIC_PREFIX, labels, entry['count']))
+    lines += [
+        '# HELP %s_lines_total dump lines scanned' % METRIC_PREFIX,
+        '# TYPE %s_lines_total counter' % METRIC_PREFIX,
+    ]
+    for worker, worker_metrics in sorted(metrics['workers'].items()):
+        lines.append('%s_lines_total{worker="%s"} %d' % (METRIC_PREFIX, worker, worker_metrics['lines']))
+    lines += [
+        '# HELP %s_progress_bytes compressed bytes of the finished ranges' % METRIC_PREFIX,
+        '# TYPE %s_progress_bytes gauge' % METRIC_PREFIX,
+        '%s_progress_bytes{kind="done"} %d' % (METRIC_PREFIX, metrics['done_bytes']),
+        '%s_progress_bytes{kind="total"} %d' % (METRIC_PREFIX, metrics['total_bytes']),
+    ]
+    return '\n'.join(lines) + '\n'
+
+def write_metrics_file(file_path, metrics, metrics_format='json'):
+    #the file is replaced atomically, so that a collector never reads a partial snapshot
+    tmp_path = '%s.tmp' % os.path.abspath(file_path)
+    with open(tmp_path, 'w') as metrics_file:
+        if metrics_format == 'prometheus':
+            metrics_file.write(prometheus_text(metrics))
+        else:
+            json.dump(metrics, metrics_file, indent=1)
+    os.replace(tmp_path, os.path.abspath(file_path))
+
+class RangeProfiler():
+    #cProfile of one range out of every `every` ranges of a worker, the stats are dumped as <range>.prof files
+    def __init__(self, profile_path, every=0):
+        self.profile_path = os.path.abspath(profile_path)
+        self.every = every
+        self.ranges = 0
+        self.profile = None
+
+    def start(self, range_name):
+        self.ranges += 1
+        if not self.every or (self.ranges - 1) % self.every != 0:
+            return
+        self.range_name = range_name
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self):
+        if self.profile is None:
+            return
+        self.profile.disable()
+        os.makedirs(self.profile_path, exist_ok=True)
+        self.profile.dump_stats(os.path.join(self.profile_path, '%s.prof' % self.range_name))
+        self.profile = None
+
+def clear_profiles(profile_path):
+    #range profiles of earlier runs are removed, so that the summary only covers the current run
+    for profile_file in glob.glob(os.path.join(os.path.abspath(profile_path), '*.prof')):
+        os.remove(profile_file)
+
+def summarise_profiles(profile_path, output_file, limit=40):
+    #merges the sampled range profiles into one text report sorted by cumulative time
+    profile_files = sorted(glob.glob(os.path.join(os.path.abspath(profile_path), '*.prof')))
+    if not profile_files:
+        return 0
+    with open(os.path.abspath(output_file), 'w') as report_file:
+        stats = pstats.Stats(*profile_files, stream=report_file)
+        stats.sort_stats('cumulative').print_stats(limit)
+    return len(profile_files)
@@ -1,110 +1,248 @@
 import os
 import tqdm
 from utils import *
-import bz2
 import json
 import multiprocessing
+import queue
+import shutil
+import time
+from dump_reader import read_range_lines, line_entity_id, split_ranges, build_dump_index, dump_index_is_current, load_dump_index, select_chunks
+from claims import ClaimFilter, format_datavalue
+from id_registry import update_id_mapping
+from columnar import COLUMNAR_FORMATS, DEFAULT_ROW_GROUP_SIZE, ColumnarWriter, columnar_file_path, merge_columnar_files, require_pyarrow
+from metrics import StageMetrics, merge_snapshots, write_metrics_file, RangeProfiler, clear_profiles, summarise_profiles
 
 
+#filter of the default config, string and monolingualtext attributes of every property
+DEFAULT_FILTER = ClaimFilter()
+
 #proper key values documentation is presented here: https://www.mediawiki.org/wiki/Wikibase/DataModel/JSON
-def get_node_data(node_data):
+#empty maps are serialised as [] in the dump, so key checks use `in` which works for both
+def get_node_data(node_data, lang='en'):
     data = {}
-    #mandatory check for english labels
-    if not (is_key_exists('labels', node_data) and is_key_exists('en', node_data['labels'])):
+    #mandatory check for labels in the language
+    labels = node_data.get('labels', ())
+    if lang not in labels:
         return False, data
     data.update({
-        'en_label': clean_str(node_data['labels']['en']['value']),
-        'en_desc': '', 
+        '%s_label' % lang: clean_str(labels[lang]['value']),
+        '%s_desc' % lang: '', 
     })
     
     #optional check for description
-    if (is_key_exists('descriptions', node_data) and is_key_exists('en', node_data['descriptions'])):
+    descriptions = node_data.get('descriptions', ())
+    if lang in descriptions:
         data.update({
-            'en_desc': clean_str(node_data['descriptions']['en']['value']),
+            '%s_desc' % lang: clean_str(descriptions[lang]['value']),
         })
     
     return True, data
 
-def get_all_attributes(node_data):
+def get_claim_data(entity_id, claims, claim_filter, node_attributes):
+    #single pass over the claims of a node. attributes are appended to the {lang: []} lists of node_attributes, string
+    #like values are shared by all the languages while monolingual text goes to its own language. returns the
+    #properties of the kept attributes and the `head property tail` relations selected by the filter
     node_properties = set()
-    status, data = get_node_data(node_data)
-    if not status:
-        return status, data, node_properties
-    #updates the language dependent wikipedia title
-    if is_key_exists('sitelinks', node_data) and is_key_exists('enwiki', node_data['sitelinks']):
-        data.update({
-            'en_wikipedia_title': node_data['sitelinks']['enwiki'].get('title', ''), 
-        })
-    #update the alias
-    if is_key_exists('aliases', node_data) and is_key_exists('en', node_data['aliases']):
-        aliases = node_data['aliases']['en']
-        node_alias = []
-        for a in aliases:
-            node_alias.append(a['value'])
-        data.update({
-            'aliases': node_alias, 
-        })
-    node_attributes = []
-    claims = node_data.get('claims', None)
-    if claims is not None:
-        for property_id, property_data in claims.items():
-            property_id = clean_str(property_id)
-            if len(property_data) == 0:
+    relations = []
+    #the compiled tables of the filter are bound to locals, this hot loop is the only place applying them to the snaks
+    properties, ranks, datatype_kinds = claim_filter.properties, claim_filter.ranks, claim_filter.datatype_kinds
+    for property_id, property_data in claims.items():
+        #claim keys are property ids, no cleaning is needed
+        if properties is not None and property_id not in properties:
+            continue
+        for snak in property_data:
+            if ranks is not None and snak.get('rank', None) not in ranks:
                 continue
-            for snak in property_data:
-                # rank = snak.get('rank', None)
-                # if (rank is not None) and not is_key_exists(rank, wiki_config['snak_rank']):
-                #     continue
-                if not is_key_exists('mainsnak', snak):
+            mainsnak = snak.get('mainsnak', None)
+            if mainsnak is None or mainsnak.get('snaktype', None) != 'value':
+                continue
+            kind = datatype_kinds.get(mainsnak.get('datatype', None), None)
+            if kind is None:
+                continue
+            try:
+                value = format_datavalue(mainsnak['datavalue'])
+                if kind == 'relation':
+                    relations.append((entity_id, property_id, value))
                     continue
-                mainsnak = snak.get('mainsnak')
-                snak_type = mainsnak.get('snaktype', None)
-                if snak_type is None or clean_str(snak_type) != 'value':
+                if not node_attributes:
                     continue
-                mainsnak_datatype = mainsnak.get('datatype', None)
-                try:
-                    if mainsnak_datatype is None or clean_str(mainsnak_datatype) not in ['string', 'monolingualtext']:
+                if isinstance(value, tuple):
+                    lang, value = value
+                    if lang not in node_attributes:
                         continue
-                    datavalue_type = clean_str(mainsnak['datavalue']['type'])
-                    datavalue_entry = mainsnak['datavalue']['value']
-                    if datavalue_type == 'string':
-                        node_attributes.append([property_id, datavalue_entry])
-                        node_properties.add(property_id)
-                    if datavalue_type == 'monolingualtext' and datavalue_entry['language']=='en':
-                        node_attributes.append([property_id, datavalue_entry['text']])
-                        node_properties.add(property_id)
-
-                except Exception as e:
-                    logger.error(" unable to process main-snak %s. original exception: %s" % (str(mainsnak), str(e)))
-    data.update({
-        'attributes': node_attributes,
-    })
+                    targets = [node_attributes[lang]]
+                else:
+                    targets = node_attributes.values()
+                attribute = [property_id, value]
+                if claim_filter.keep_qualifiers:
+                    attribute.append(claim_filter.qualifiers_of(snak))
+                for attributes in targets:
+                    attributes.append(attribute)
+                node_properties.add(property_id)
+
+            except Exception as e:
+                logger.error(" unable to process main-snak %s. original exception: %s" % (str(mainsnak), str(e)))
+    return node_properties, relations
+
+def get_multilingual_attributes(node_data, languages, claim_filter=DEFAULT_FILTER):
+    #collects the data of every language in a single pass over the claims.
+    #returns {lang: (status, data)}, the attribute properties and the relations
+    results = {lang: get_node_data(node_data, lang) for lang in languages}
+    node_attributes = {}
+    sitelinks = node_data.get('sitelinks', ())
+    aliases = node_data.get('aliases', ())
+    for lang, (status, data) in results.items():
+        if not status:
+            continue
+        #updates the language dependent wikipedia title
+        if '%swiki' % lang in sitelinks:
+            data.update({
+                '%s_wikipedia_title' % lang: sitelinks['%swiki' % lang].get('title', ''), 
+            })
+        #update the alias
+        if lang in aliases:
+            data.update({
+                'aliases': [a['value'] for a in aliases[lang]], 
+            })
+        node_attributes[lang] = []
+    claims = node_data.get('claims', None)
+    node_properties, relations = set(), []
+    if claims and (node_attributes or claim_filter.has_relations):
+        node_properties, relations = get_claim_data(node_data.get('id', None), claims, claim_filter, node_attributes)
+    for lang, attributes in node_attributes.items():
+        results[lang][1].update({
+            'attributes': attributes,
+        })
+    return results, node_properties, relations
+
+def get_all_attributes(node_data, lang='en', claim_filter=DEFAULT_FILTER):
+    results, node_properties, _ = get_multilingual_attributes(node_data, [lang], claim_filter)
+    status, data = results[lang]
     return status, data, node_properties
 
-def load_worker_data(logger, worker_config):
+def extract_node(data, entity_nodes, property_nodes, target_nodes, languages, claim_filter=DEFAULT_FILTER):
+    #(node type, id, {lang: (status, data)}, attribute properties, relations) of a dump record, the node type being
+    #'entities' or 'properties' for the requested nodes and None otherwise
+    entity_id = data.get('id', None)
+    entity_type = data.get('type', None)
+    if entity_id is None or entity_type is None:
+        return None, entity_id, {}, set(), []
+    entity_id, entity_type = clean_str(entity_id), clean_str(entity_type)
+    if entity_type=='item' and entity_id in entity_nodes:
+        if entity_id in target_nodes:
+            results, node_attributes, relations = get_multilingual_attributes(data, languages, claim_filter)
+            return 'entities', entity_id, results, node_attributes, relations
+        results = {lang: get_node_data(data, lang) for lang in languages}
+        relations = []
+        if claim_filter.has_relations and data.get('claims', None):
+            _, relations = get_claim_data(entity_id, data['claims'], claim_filter, {})
+        return 'entities', entity_id, results, set(), relations
+    if entity_type=='property' and entity_id in property_nodes:
+        return 'properties', entity_id, {lang: get_node_data(data, lang) for lang in languages}, set(), []
+    return None, entity_id, {}, set(), []
+
+def language_node_type(node_type, lang):
+    #english output keeps the original file names, other languages get their own sinks
+    return node_type if lang == 'en' else '%s-%s' % (node_type, lang)
+
+def iter_worker_data(logger, worker_config, node_type):
+    cache_file = os.path.join(os.path.abspath(worker_config['store_path']), "%s-{}.txt"%worker_config['name']).format(node_type)
+    logger.debug('streaming - %s - from file : %s' %(node_type, cache_file))
+    for node_id, info in iter_json_lines(cache_file):
+        yield node_id, info
+
+def range_name(start, end):
+    #ranges are named by their compressed byte extents, so a name means the same bytes whatever the worker count
+    return 'range-%d-%d' % (start, end)
+
+def run_signature(dump_path, entities, properties, target_nodes, claim_filter, languages, output_formats):
+    #done markers hold the signature of their run, a range is only resumed for the same dump, requested ids and outputs
+    stat = os.stat(os.path.abspath(dump_path))
+    signature = {'dump_size': stat.st_size, 'dump_mtime_ns': stat.st_mtime_ns,
+                 'ids_digest': '-'.join(node_ids.digest() for node_ids in [entities, properties, target_nodes]),
+                 'claim_filter': claim_filter.config, 'languages': languages, 'output_formats': output_formats}
+    #the json round trip makes the signature comparable with the one read back from a marker
+    return json.loads(json.dumps(signature))
+
+def store_scanned_ids(store_path, node_type, node_ids, prefix, unscanned=()):
+    #requested ids whose dump records were read, incremental runs only read the dump for ids missing from this bitmap
+    scanned_file = os.path.join(os.path.abspath(store_path), "%s-scanned.bitmap" % node_type)
+    tmp_file = '%s.tmp' % scanned_file
+    if unscanned:
+        IdBitmap.build(tmp_file, (node_id for node_id in node_ids if node_id not in unscanned), prefix)
+    else:
+        shutil.copyfile(node_ids.file_path, tmp_file)
+    os.replace(tmp_file, scanned_file)
+
+def worker_data_exists(worker_config):
+    file_path = os.path.join(os.path.abspath(worker_config['store_path']), "%s-{}.txt"%worker_config['name'])
+    if not os.path.exists(file_path.format('done')):
+        return False
+    #markers of another dump or of other requested nodes are ignored
+    with open(file_path.format('done'), 'r') as done_file:
+        try:
+            return json.load(done_file) == worker_config.get('signature', None)
+        except ValueError:
+            return False
+
+def open_worker_data(worker_config):
+    #json lines and the columnar formats of output_formats are written side by side while the range is read
     file_path = os.path.join(os.path.abspath(worker_config['store_path']), "%s-{}.txt"%worker_config['name'])
-    logger.debug('loading and cleaning up extra files')
-    cache_file_names = {'entities': None, 'properties': None}
-    for file_name in cache_file_names:
-        cache_file = file_path.format(file_name)
-        with open(cache_file, 'r') as data_file:
-            cache_file_names[file_name] = json.load(data_file)
-        logger.debug('successfully loaded - %s - from file : %s' %(file_name, cache_file))
-    return cache_file_names['entities'], cache_file_names['properties']
-
-def store_worker_data(worker_config, node_info, new_attributes=[]):
+    #the marker of a previous run is dropped, the range is done again once the new data is stored
+    if os.path.exists(file_path.format('done')):
+        os.remove(file_path.format('done'))
+    output_formats = worker_config.get('output_formats', ['json'])
+    node_writers = {}
+    for lang in worker_config.get('languages', ['en']):
+        for node_type in ['entities', 'properties']:
+            node_file = file_path.format(language_node_type(node_type, lang))
+            writers = [JsonLinesWriter(node_file, worker_config.get('flush_every', 1000))] if 'json' in output_formats else []
+            writers += [ColumnarWriter(columnar_file_path(node_file, file_format), lang, file_format, worker_config.get('row_group_size', DEFAULT_ROW_GROUP_SIZE))
+                        for file_format in output_formats if file_format in COLUMNAR_FORMATS]
+            node_writers[language_node_type(node_type, lang)] = writers[0] if len(writers) == 1 else MultiWriter(writers)
+    return node_writers
+
+def open_worker_relations(worker_config):
+    file_path = os.path.join(os.path.abspath(worker_config['store_path']), "%s-{}.txt"%worker_config['name'])
+    return open(file_path.format('relations'), 'w')
+
+def store_worker_data(worker_config, node_writers, new_attributes=[], relations_file=None):
     file_path = os.path.join(os.path.abspath(worker_config['store_path']), "%s-{}.txt"%worker_config['name'])
     logger = worker_config['logger']
-    for node_type, node_data in node_info.items():
-        cache_file = file_path.format(node_type)
-        with open(cache_file, 'w') as data_file:
-            json.dump(node_data, data_file)
-        logger.debug('successfully stored - %s - to file : %s' %(node_type, cache_file))
+    if relations_file is not None:
+        relations_file.close()
+    for node_type, node_writer in node_writers.items():
+        node_writer.close()
+        logger.debug('successfully stored %d - %s - to file : %s' %(node_writer.count, node_type, node_writer.file_path))
     
     if len(new_attributes)!=0:
         with open(file_path.format('attributes'), 'w') as af:
             for attribute in new_attributes:
                 af.write("%s\n"%attribute)
+    #the range is only complete once its done marker exists
+    with open(file_path.format('done'), 'w') as done_file:
+        json.dump(worker_config.get('signature', None), done_file)
+
+def merge_worker_data(logger, range_configs, node_type, output_file):
+    #streams the json lines of every range into one json object, only the ids are kept in memory
+    node_ids = set()
+    with open(output_file, 'w') as data_file:
+        data_file.write('{')
+        for range_config in range_configs:
+            for node_id, info in iter_worker_data(logger, range_config, node_type):
+                data_file.write('%s%s: %s' % (', ' if node_ids else '', json.dumps(node_id), json.dumps(info)))
+                node_ids.add(node_id)
+        data_file.write('}')
+    return node_ids
+
+def merge_worker_relations(logger, range_configs, output_file):
+    #concatenates the relation triples of every range into one `head property tail` file
+    with open(output_file, 'wb') as triples_file:
+        for range_config in range_configs:
+            relations_file = os.path.join(os.path.abspath(range_config['store_path']), "%s-relations.txt"%range_config['name'])
+            logger.debug('streaming - relations - from file : %s' % relations_file)
+            with open(relations_file, 'rb') as rf:
+                shutil.copyfileobj(rf, triples_file)
 
 def collect_node_data(worker_config):
     start_time = datetime.utcnow()
@@ -112,27 +250,59 @@ def collect_node_data(worker_config):
     logger = worker_config.get('logger')
     property_nodes = worker_config.get('properties')
     entity_nodes = worker_config.get('entities')
+    target_nodes = worker_config.get('target_nodes')
+    #relation tails are checked against the requested nodes unless other tail sets are given
+    tail_entities = entity_nodes if worker_config.get('tail_entities') is None else worker_config['tail_entities']
+    tail_properties = property_nodes if worker_config.get('tail_properties') is None else worker_config['tail_properties']
+    #every language is extracted in the same pass over the dump
+    languages = worker_config.get('languages', ['en'])
+    node_fields, attribute_fields = get_node_fields(languages), get_attribute_fields(languages)
+    claim_filter = worker_config.get('claim_filter', DEFAULT_FILTER)
     
-    node_info = {
-        'entities': {},
-        'properties': {},
-    }
-    new_attributes = set()
-    #offset indicates line from which it start reading wikidata
-    def wikidata(filepath, offset=1, step=1):
-        with bz2.open(os.path.abspath(filepath), mode='rt') as dump_file:
-            line_count=0
-            dump_file.read(2) # skip first two bytes: "{\n"
-            for line in dump_file:
-                line_count+=1
-                if offset > line_count or (line_count - offset)%step != 0:
-                    continue
-                try:
-                    yield json.loads(line.rstrip(',\n'))
-                except json.decoder.JSONDecodeError:
-                    continue
+    json_backend, json_loads = get_json_loader(worker_config.get('json_backend', 'auto'))
+    #lines whose id is not requested are dropped before json parsing
+    prefiltered_lines = 0
+    #scanned lines not yet reported to the parent process
+    unreported_lines, last_report = 0, time.monotonic()
+    #per stage timings of this worker, sent to the parent with every progress report
+    metrics, clock = StageMetrics(), time.perf_counter
+    profiler = RangeProfiler(worker_config.get('profile_path', '.'), worker_config.get('profile_every', 0))
+    def report_progress(done_bytes=0):
+        nonlocal unreported_lines, last_report
+        worker_config['progress_queue'].put((worker_config['name'], unreported_lines, done_bytes, metrics.snapshot()))
+        unreported_lines, last_report = 0, time.monotonic()
+    
+    #start and end delimit a compressed byte range of the dump read by this worker
+    def wikidata(filepath, start=0, end=None, blocks=None):
+        nonlocal prefiltered_lines, unreported_lines
+        lines = read_range_lines(os.path.abspath(filepath), start, end, blocks)
+        while True:
+            #read covers the bz2 decompression and the line splitting
+            read_start = clock()
+            line = next(lines, None)
+            parse_start = clock()
+            metrics.add('read', parse_start - read_start)
+            if line is None:
+                return
+            unreported_lines+=1
+            if unreported_lines % 10000 == 0 and time.monotonic() - last_report >= worker_config['progress_secs']:
+                report_progress()
+            line_id = line_entity_id(line)
+            if line_id is not None and line_id not in entity_nodes and line_id not in property_nodes:
+                prefiltered_lines+=1
+                metrics.add('prefilter', clock() - parse_start)
+                continue
+            #claims, aliases and sitelinks are only read for the target nodes, or for all the nodes when relations are kept
+            fields = attribute_fields if line_id is None or claim_filter.has_relations or line_id in target_nodes else node_fields
+            try:
+                data = json_loads(line.rstrip(b',\r'), fields)
+            except ValueError:
+                continue
+            finally:
+                metrics.add('parse', clock() - parse_start)
+            yield data
     
-    logger.info("started processing node information")
+    logger.info("started processing node information with %s json backend" % json_backend)
     #clear the previously collected triples , properties and tail_entities 
     logger.info(" print marker is set to : %s" % (int(worker_config['marker'])))
     
@@ -141,64 +311,189 @@ def collect_node_data(worker_config):
     invalid_entities, inavlid_properties = 0, 0
     marker_start_time = datetime.utcnow()
     counter=0
-    for data in wikidata(worker_config['dumpfile'], offset=worker_config['offset'], step=worker_config['step']):
-        counter+=1
-        if counter % int(worker_config['marker']) == 0:
-            marker_delta = (datetime.utcnow() - marker_start_time).total_seconds()
-            logger.info(" | %d M | explored new entities - %d and properties - %d. [%d secs]" % ((counter/1e6), searchable_entities, searchable_properties, marker_delta))
-            logger.debug(" | %d invalid entities, %d  invalid properties" % (invalid_entities, inavlid_properties))
-            marker_start_time = datetime.utcnow()
-            if len(node_info['entities'])>=50 and len(node_info['properties'])>=5:
-                break
-        entity_id = data.get('id', None)
-        entity_type = data.get('type', None)
-        if entity_id is None or entity_type is None:
+    #ranges are taken from the shared queue until the None sentinel, so idle workers pick up the remaining ones.
+    #results are stored once per range, so that a restarted run can resume after the last finished range
+    for name, start, end in iter(worker_config['task_queue'].get, None):
+        range_config = {'name': name, 'store_path': worker_config['store_path'], 'logger': logger, 'flush_every': worker_config.get('flush_every', 1000), 'languages': languages,
+                        'output_formats': worker_config.get('output_formats', ['json']), 'row_group_size': worker_config.get('row_group_size', DEFAULT_ROW_GROUP_SIZE),
+                        'signature': worker_config.get('signature')}
+        if worker_config.get('resume', False) and worker_data_exists(range_config):
+            logger.info(" skipping already processed range : %s" % name)
+            report_progress(end - start)
             continue
-        entity_id, entity_type = clean_str(entity_id), clean_str(entity_type)
-        if entity_type=='item' and entity_id in entity_nodes:
-            searchable_entities+=1
-            if entity_id in worker_config.get('target_nodes'):
-                status, info, node_attributes = get_all_attributes(data)
-                for attributes in node_attributes:
-                    if attributes not in property_nodes:
-                        new_attributes.add(attributes)
-            else:
-                status, info = get_node_data(data)
-            if not status:
-                invalid_entities+=1
+        profiler.start(name)
+        node_writers = open_worker_data(range_config)
+        relations_file = open_worker_relations(range_config) if claim_filter.has_relations else None
+        new_attributes = set()
+        for data in wikidata(worker_config['dumpfile'], start=start, end=end, blocks=worker_config.get('blocks')):
+            counter+=1
+            if counter % int(worker_config['marker']) == 0:
+                marker_delta = (datetime.utcnow() - marker_start_time).total_seconds()
+                logger.info(" | %d M | explored new entities - %d and properties - %d. [%d secs]" % ((counter/1e6), searchable_entities, searchable_properties, marker_delta))
+                logger.debug(" | %d invalid entities, %d  invalid properties, %d lines skipped by id prefilter" % (invalid_entities, inavlid_properties, prefiltered_lines))
+                logger.debug(" | stage timings : %s" % metrics.summary())
+                marker_start_time = datetime.utcnow()
+                if node_writers[language_node_type('entities', languages[0])].count>=50 and node_writers[language_node_type('properties', languages[0])].count>=5:
+                    break
+            extract_start = clock()
+            node_type, entity_id, results, node_attributes, relations = extract_node(data, entity_nodes, property_nodes, target_nodes, languages, claim_filter)
+            write_start = clock()
+            metrics.add('extract', write_start - extract_start)
+            if node_type is None:
                 continue
-            node_info['entities'][entity_id] = info
-        
-        if entity_type=='property' and entity_id in property_nodes:
-            searchable_properties+=1
-            status, info = get_node_data(data)
-            if not status:
-                inavlid_properties+=1
+            if node_type == 'entities':
+                searchable_entities+=1
+            else:
+                searchable_properties+=1
+            for attributes in node_attributes:
+                if attributes not in property_nodes:
+                    new_attributes.add(attributes)
+            #relations are kept between requested nodes only
+            for head, relation, tail in relations:
+                if tail in tail_entities or tail in tail_properties:
+                    relations_file.write("%s %s %s\n" % (head, relation, tail))
+            if not any(status for status, _ in results.values()):
+                if node_type == 'entities':
+                    invalid_entities+=1
+                else:
+                    inavlid_properties+=1
                 continue
-            node_info['properties'][entity_id] = info
+            for lang, (status, info) in results.items():
+                if status:
+                    node_writers[language_node_type(node_type, lang)].write([entity_id, info])
+            metrics.add('write', clock() - write_start)
+        store_start = clock()
+        store_worker_data(range_config, node_writers, new_attributes=list(new_attributes), relations_file=relations_file)
+        metrics.add('store', clock() - store_start)
+        profiler.stop()
+        report_progress(end - start)
 
     valid_entities = searchable_entities - invalid_entities
     valid_properties =  searchable_properties - inavlid_properties
     logger.info("node information extracted for %d/%d entities and %d/%d properties" % (valid_entities, searchable_entities, valid_properties, searchable_properties))
+    logger.info(" %d lines skipped by id prefilter" % prefiltered_lines)
+    logger.info(" stage timings : %s" % metrics.summary())
     time_delta = (datetime.utcnow() - start_time).total_seconds()
     logger.info(" completed in %f secs" % time_delta)
-    store_worker_data(worker_config, node_info, new_attributes=list(new_attributes))
+
+def monitor_workers(logger, worker_handler, progress_queue, total_bytes, progress_secs=60, metrics_file=None, metrics_format='json'):
+    #aggregates the (worker, scanned lines, finished compressed bytes, stage metrics) reports of the workers until all
+    #of them exit. with metrics_file set the aggregated metrics are written there at every progress report
+    start_time = time.monotonic()
+    last_report = start_time
+    worker_lines, worker_metrics = {}, {}
+    done_lines, done_bytes = 0, 0
+    def consume(message):
+        nonlocal done_lines, done_bytes
+        name, lines, nbytes, snapshot = message
+        worker_lines[name] = worker_lines.get(name, 0) + lines
+        #the stage metrics of a worker are cumulative, the last snapshot replaces the previous one
+        worker_metrics[name] = snapshot
+        done_lines += lines
+        done_bytes += nbytes
+    def export_metrics():
+        if metrics_file is None:
+            return
+        write_metrics_file(metrics_file, {
+            'updated_at': datetime.utcnow().isoformat(),
+            'elapsed_secs': time.monotonic() - start_time,
+            'done_bytes': done_bytes,
+            'total_bytes': total_bytes,
+            'workers': {name: {'lines': worker_lines[name], 'stages': snapshot} for name, snapshot in worker_metrics.items()},
+            'stages': merge_snapshots(worker_metrics.values()),
+        }, metrics_format)
+    while any(worker.is_alive() for worker in worker_handler):
+        try:
+            consume(progress_queue.get(timeout=1))
+        except queue.Empty:
+            pass
+        now = time.monotonic()
+        if now - last_report < progress_secs:
+            continue
+        last_report = now
+        elapsed = now - start_time
+        eta = (total_bytes - done_bytes) * elapsed / done_bytes if done_bytes else float('nan')
+        logger.info(' | progress %.1f%% | %d lines at %d lines/sec | eta %.0f secs' % (100.0 * done_bytes / max(total_bytes, 1), done_lines, done_lines / elapsed, eta))
+        logger.debug(' | per worker lines/sec : %s' % ', '.join('%s %d' % (name, lines / elapsed) for name, lines in sorted(worker_lines.items())))
+        export_metrics()
+    while True:
+        try:
+            consume(progress_queue.get_nowait())
+        except queue.Empty:
+            break
+    logger.info(' scanned %d lines at %d lines/sec' % (done_lines, done_lines / max(time.monotonic() - start_time, 1e-9)))
+    stages = merge_snapshots(worker_metrics.values())
+    logger.info(' stage timings : %s' % ', '.join('%s %.1f secs' % (stage, entry['secs']) for stage, entry in stages.items()))
+    export_metrics()
 
 def extract_node_data_from_dump(logger, config, properties, entities):
     worker_count = config.get('thread_count', 1)
     global_worker_config = {}
+    dump_path = config.get('wikidata_dump_path')
+    #lookup sets are built once into memory mapped bitmaps shared by all the workers
+    id_file_path = os.path.join(os.path.abspath(config.get('store_path')), "{}-ids.bitmap")
+    entities = as_id_bitmap(id_file_path.format('entities'), entities, 'Q')
+    properties = as_id_bitmap(id_file_path.format('properties'), properties, 'P')
+    target_nodes = as_id_bitmap(id_file_path.format('targets'), config.get('target_nodes'), 'Q')
+    #json is the default output, parquet and arrow are optional columnar outputs
+    output_formats = config.get('output_formats', ['json'])
+    require_pyarrow(output_formats)
+    #the declarative claim filter is compiled once and shipped to the workers
+    claim_filter = ClaimFilter(config.get('claim_filter', None))
+    index_path = config.get('dump_index_path', None)
+    blocks = None
+    if index_path is None:
+        #every range decompresses only its own share of the bz2 blocks
+        range_count = worker_count * config.get('ranges_per_worker', 16)
+        dump_ranges = [(range_name(start, end), start, end) for start, end in split_ranges(dump_path, range_count)]
+    else:
+        if not dump_index_is_current(dump_path, index_path):
+            logger.info(' building dump index : %s' % index_path)
+            build_dump_index(dump_path, index_path, processes=worker_count)
+        dump_index = load_dump_index(index_path)
+        blocks = dump_index['blocks']
+        #only the chunks holding some of the requested ids are read
+        chunk_ids = select_chunks(dump_index, entities.numbers(), properties.numbers())
+        logger.info(' reading %d/%d chunks of the dump index' % (len(chunk_ids), len(dump_index['chunks'])))
+        dump_ranges = [(range_name(dump_index['chunks'][chunk_id][2], dump_index['chunks'][chunk_id][3]), dump_index['chunks'][chunk_id][2], dump_index['chunks'][chunk_id][3]) for chunk_id in chunk_ids]
+    signature = run_signature(dump_path, entities, properties, target_nodes, claim_filter, config.get('languages', ['en']), output_formats)
+    #stage metrics snapshots, as json or as a prometheus textfile, and the sampled range profiles
+    metrics_format = config.get('metrics_format', 'json')
+    metrics_file = config.get('metrics_file', os.path.join(os.path.abspath(config.get('store_path')), 'metrics.prom' if metrics_format == 'prometheus' else 'metrics.json'))
+    profile_path = config.get('profile_path', os.path.join(os.path.abspath(config.get('store_path')), 'profiles'))
+    if config.get('profile_every', 0):
+        clear_profiles(profile_path)
+    task_queue, progress_queue = multiprocessing.Queue(), multiprocessing.Queue()
+    for dump_range in dump_ranges:
+        task_queue.put(dump_range)
+    for _ in range(worker_count):
+        task_queue.put(None)
     #configuring workers
     for i in range(1, worker_count+1):
         local_config = {'name': 'worker-%s'%(i),
-                        'dumpfile': config.get('wikidata_dump_path'),
-                        'offset': i,
-                        'step': worker_count,
+                        'dumpfile': dump_path,
+                        'task_queue': task_queue,
+                        'progress_queue': progress_queue,
+                        'progress_secs': config.get('progress_secs', 60),
+                        'blocks': blocks,
+                        'resume': config.get('resume', False),
+                        'signature': signature,
+                        'json_backend': config.get('json_backend', 'auto'),
+                        'flush_every': config.get('flush_every', 1000),
+                        'languages': config.get('languages', ['en']),
+                        'claim_filter': claim_filter,
+                        'profile_every': config.get('profile_every', 0),
+                        'output_formats': output_formats,
+                        'row_group_size': config.get('row_group_size', DEFAULT_ROW_GROUP_SIZE),
+                        'profile_path': profile_path,
                         'logger': None,
                         'marker': config.get('marker', 1e6),
                         'store_path': config.get('store_path'),
                         'properties': properties,
                         'entities': entities,
-                        'target_nodes': config.get('target_nodes'),
+                        'target_nodes': target_nodes,
+                        'tail_entities': config.get('tail_entities', None),
+                        'tail_properties': config.get('tail_properties', None),
                         }
     
         log_file_path = os.path.join(config.get('log_path', '.'), "%s.log"%local_config['name'])
@@ -216,32 +511,58 @@ def extract_node_data_from_dump(logger, config, properties, entities):
     #execute the workers
     for worker in worker_handler:
         worker.start()
+    monitor_workers(logger, worker_handler, progress_queue, sum(end - start for _, start, end in dump_ranges), config.get('progress_secs', 60),
+                    metrics_file, config.get('metrics_format', 'json'))
     #wait for workers to complete
     for worker in worker_handler:
         worker.join()
+        if worker.exitcode != 0:
+            logger.error(' worker process %s exited with code %s' % (worker.name, worker.exitcode))
     time_delta = (datetime.utcnow() - start_time).total_seconds()
     logger.info(' all workers job completed in %f seconds' % time_delta)
+    if config.get('profile_every', 0):
+        profile_count = summarise_profiles(profile_path, os.path.join(profile_path, 'summary.txt'))
+        logger.info(' merged %d range profiles into : %s' % (profile_count, os.path.join(profile_path, 'summary.txt')))
     
-    global_properties, global_entities = {}, {}
-    for worker_id in range(1, worker_count+1):
-        new_entities, new_properties = load_worker_data(logger, global_worker_config[worker_id])
-        global_properties.update(new_properties)
-        global_entities.update(new_entities)
+    range_configs = [{'name': name, 'store_path': config.get('store_path'), 'signature': signature} for name, _, _ in dump_ranges]
+    #outputs are only built from complete runs, the partial data of a range whose worker died is never merged
+    failed_workers = [worker.name for worker in worker_handler if worker.exitcode != 0]
+    unfinished_ranges = [range_config['name'] for range_config in range_configs if not worker_data_exists(range_config)]
+    if failed_workers or unfinished_ranges:
+        logger.error(' unfinished ranges : %s' % ', '.join(unfinished_ranges))
+        raise RuntimeError('%d worker processes failed and %d/%d ranges are unfinished, rerun with resume set to read the remaining ranges' % (
+            len(failed_workers), len(unfinished_ranges), len(range_configs)))
 
-    logger.info(' total node infromation extracted for %d/%d entities, %d/%d properties' % (len(global_entities), len(entities), len(global_properties), len(properties)))
-    
-    #save the files
+    #save the files, one pair of files per language and output format
     file_path = os.path.join(os.path.abspath(config.get('store_path')), "{}-info.txt")
-    
-    properties_file = file_path.format("properties")    
-    with open(properties_file, 'w') as data_file:
-        json.dump(global_properties, data_file)
-    logger.info(" successfully stored properties info to file : %s" % properties_file)
-    
-    entities_file = file_path.format("entities")    
-    with open(entities_file, 'w') as data_file:
-        json.dump(global_entities, data_file)
-    logger.info(" stored entities info to file : %s" % entities_file)
+    range_file_path = os.path.join(os.path.abspath(config.get('store_path')), "{}-{}.txt")
+    languages = config.get('languages', ['en'])
+    extracted_ids = {}
+    for lang in languages:
+        for node_type in ['properties', 'entities']:
+            node_type_name = language_node_type(node_type, lang)
+            if 'json' in output_formats:
+                extracted_ids[(node_type, lang)] = merge_worker_data(logger, range_configs, node_type_name, file_path.format(node_type_name))
+                logger.info(" stored %s info to file : %s" % (node_type, file_path.format(node_type_name)))
+            for file_format in output_formats:
+                if file_format not in COLUMNAR_FORMATS:
+                    continue
+                range_files = [columnar_file_path(range_file_path.format(name, node_type_name), file_format) for name, _, _ in dump_ranges]
+                columnar_file = columnar_file_path(file_path.format(node_type_name), file_format)
+                node_ids = merge_columnar_files(logger, range_files, columnar_file, lang, file_format, config.get('row_group_size', DEFAULT_ROW_GROUP_SIZE))
+                extracted_ids.setdefault((node_type, lang), node_ids)
+                logger.info(" stored %s info to %s file : %s" % (node_type, file_format, columnar_file))
+    if claim_filter.has_relations:
+        triples_file = os.path.join(os.path.abspath(config.get('store_path')), "triples.txt")
+        merge_worker_relations(logger, range_configs, triples_file)
+        logger.info(" stored relation triples to file : %s" % triples_file)
+    #the ids of the first language are the ones returned
+    global_entities, global_properties = extracted_ids[('entities', languages[0])], extracted_ids[('properties', languages[0])]
+    store_scanned_ids(config.get('store_path'), 'entities', entities, 'Q')
+    store_scanned_ids(config.get('store_path'), 'properties', properties, 'P')
+
+    logger.info(' total node infromation extracted for %d/%d entities, %d/%d properties' % (len(global_entities), len(entities), len(global_properties), len(properties)))
+    #only the extracted ids are returned, the node information stays on disk
     return global_entities, global_properties
 
 if __name__ == "__main__":
@@ -253,20 +574,20 @@ if __name__ == "__main__":
     
     logger = ManualLogger('main', log_file, use_stdout=True)
 
-    target_nodes = []
+    target_nodes = set()
     logger.info('loading source nodes from file : %s' %(os.path.abspath(target_nodes_file)))
     with open(os.path.abspath(target_nodes_file), 'r') as source_file:
-        for line in source_file.readlines():
+        for line in source_file:
             entity_id = clean_str(line)
-            target_nodes.append(entity_id)
+            target_nodes.add(entity_id)
 
     properties_file = os.path.join(source_folder, 'properties.txt')
     entities_file = os.path.join(source_folder, 'entities.txt')
-    triples_file = os.path.join(source_folder, 'triples.txt')
+    #relation triples are written by the same scan of the dump
+    triples_file = os.path.join(store_path, 'triples.txt')
 
     entities = load_data(logger, entities_file)
     properties = load_data(logger, properties_file)
-    triples = load_data(logger, triples_file)
     
     config = {'thread_count': 2,
                 'marker': 1e6,
@@ -274,60 +595,30 @@ if __name__ == "__main__":
                 'log_path': "/scratch/tabhishek/wikidata/next_process/logs",
                 'store_path': store_path,
                 'target_nodes': target_nodes,
+                'claim_filter': {'relation_datatypes': ['wikibase-item']},
     }
 
     entities_info, properties_info = extract_node_data_from_dump(logger, config, properties, entities)
 
     mapping_file_path = os.path.join(os.path.abspath(store_path), "{}-map.txt")
+    registry_path = os.path.join(os.path.abspath(store_path), "{}-registry")
     
-    entities_to_id = {}
-    sorted_entities = sorted([i for i in entities_info])
-    id_counter = 1 
-    with open(mapping_file_path.format('entities'), 'w') as map_file:
-        for entity in sorted_entities:
-            entity = clean_str(entity)
-            if len(entity)==0 or entity=='':
-                continue
-            entities_to_id[entity] = id_counter
-            map_file.write("%d %s\n"%(id_counter, entity))
-            id_counter+=1
-    logger.info('successfully created the entities map file')
-
-    properties_to_id = {}
-    sorted_properties = sorted([i for i in properties_info])
-    id_counter = 1
-    with open(mapping_file_path.format('properties'), 'w') as map_file:
-        for prop in sorted_properties:
-            prop = clean_str(prop)
-            if len(prop)==0 or prop == '':
-                continue
-            properties_to_id[prop] = id_counter
-            map_file.write("%d %s\n"%(id_counter, prop))
-            id_counter+=1
-    logger.info('successfully created the properties map file')
+    #ids are kept across runs, new entities and properties are appended to the registries and to the map files
+    entities_to_id = update_id_mapping(logger, registry_path.format('entities'), mapping_file_path.format('entities'), entities_info)
+    logger.info('successfully updated the entities map file')
+
+    properties_to_id = update_id_mapping(logger, registry_path.format('properties'), mapping_file_path.format('properties'), properties_info)
+    logger.info('successfully updated the properties map file')
 
+    #codes of the previously encoded triples are stable, only the new triples are appended
     processed_triples_file = os.path.join(os.path.abspath(store_path), "coded-triples.txt")
+    stats = update_coded_triples(logger, triples_file, processed_triples_file, entities_to_id, properties_to_id,
+                                 os.path.join(os.path.abspath(store_path), "coded-triples.npy"))
+    logger.info(' %d coded triples kept, %d added and %d removed.' % (stats['kept'], stats['added'], stats['removed']))
     
-    invalid_triple_format, null_triplet, empty_mapping = 0, 0, 0
-    with open(processed_triples_file, 'w') as coded_file:
-        for triplet in triples:
-            data = triplet.split(' ')
-            if len(data) != 3:
-                invalid_triple_format +=1
-                continue
-            head, prop, tail = clean_str(data[0]), clean_str(data[1]), clean_str(data[2])
-            if len(head)==0 or len(prop)==0 or len(tail)==0 or head=='' or prop=='' or tail=='':
-                null_triplet+=1
-                continue
-            head_id, prop_id, tail_id = entities_to_id.get(head, None), properties_to_id.get(prop, None), entities_to_id.get(tail, None)
-            if head_id is None or prop_id is None or tail_id is None:
-                empty_mapping+=1
-                continue
-            coded_file.write('%s %s %s\n'% (head_id, prop_id, tail_id))
-    
-    loss = invalid_triple_format + null_triplet + empty_mapping
-    logger.info(' total processed triples %d out of %d original triples.' % (len(triples) - loss, len(triples)))
-    logger.info(' invalid-format : %d, null_triples : %d, empty_mapping : %d.' % (invalid_triple_format, null_triplet, empty_mapping))
+    loss = stats['invalid_format'] + stats['null_triples'] + stats['empty_mapping'] + stats['duplicates']
+    logger.info(' total processed triples %d out of %d original triples.' % (stats['total'] - loss, stats['total']))
+    logger.info(' invalid-format : %d, null_triples : %d, empty_mapping : %d, duplicates : %d.' % (stats['invalid_format'], stats['null_triples'], stats['empty_mapping'], stats['duplicates']))
     
     time_delta = (datetime.utcnow() - start_time).total_seconds()
     logger.info("complete the whole process in %s" % time_delta)
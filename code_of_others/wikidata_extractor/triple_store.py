@@ -0,0 +1,156 @@
+import os
+import numpy as np
+
+
+#triples are (head, tail, relation) like the tab separated files read by utils.load_triple_dict
+#the store is a directory of .npy files opened as read-only memory maps:
+#   triples.npy         (N, 3) int32 unique triples sorted by head, tail, relation
+#   head_offsets.npy    (num_ent + 1) int64, triples[head_offsets[h]:head_offsets[h+1], 1:] are the (tail, relation) of h
+#   tail_offsets.npy    (num_ent + 1) int64, tail_neighbors[tail_offsets[t]:tail_offsets[t+1]] are the (head, relation) of t
+#   tail_neighbors.npy  (N, 2) int32 sorted by tail, head, relation
+#   meta.npy            [num_ent, num_rel, num_triples]
+STORE_FILES = ['triples', 'head_offsets', 'tail_offsets', 'tail_neighbors', 'meta']
+
+
+def read_triple_file(file_path, chunk_lines=1<<20):
+    #(N, 3) int32 array of a tab separated triple file, lines without three fields are skipped
+    chunks = []
+    with open(os.path.abspath(file_path), 'rb') as triple_file:
+        while True:
+            lines = triple_file.readlines(chunk_lines * 24)
+            if not lines:
+                break
+            rows = [row for row in (line.strip().split(b'\t') for line in lines) if len(row) == 3]
+            if rows:
+                chunks.append(np.array(rows, dtype=np.int64).astype(np.int32))
+    return np.concatenate(chunks) if chunks else np.zeros((0, 3), dtype=np.int32)
+
+def build_triple_store(triples, store_path, num_ent=None, num_rel=None):
+    #writes the csr adjacency of an (N, 3) array of (head, tail, relation) triples to the store directory
+    triples = np.unique(np.asarray(triples, dtype=np.int32).reshape(-1, 3), axis=0)
+    if num_ent is None:
+        num_ent = int(triples[:, :2].max()) + 1 if len(triples) else 0
+    if num_rel is None:
+        num_rel = int(triples[:, 2].max()) + 1 if len(triples) else 0
+    heads, tails, rels = triples[:, 0], triples[:, 1], triples[:, 2]
+    head_offsets = np.zeros(num_ent + 1, dtype=np.int64)
+    np.cumsum(np.bincount(heads, minlength=num_ent), out=head_offsets[1:])
+    order = np.lexsort((rels, heads, tails))
+    tail_offsets = np.zeros(num_ent + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tails, minlength=num_ent), out=tail_offsets[1:])
+    arrays = {
+        'triples': triples,
+        'head_offsets': head_offsets,
+        'tail_offsets': tail_offsets,
+        'tail_neighbors': np.stack([heads[order], rels[order]], axis=1),
+        'meta': np.array([num_ent, num_rel, len(triples)], dtype=np.int64),
+    }
+    os.makedirs(os.path.abspath(store_path), exist_ok=True)
+    for name in STORE_FILES:
+        np.save(os.path.join(os.path.abspath(store_path), '%s.npy' % name), arrays[name])
+    return TripleStore(store_path)
+
+def open_triple_store(file_path, store_path):
+    #replacement of utils.load_triple_dict: the store is built from the tab separated file on first use only
+    if not all(os.path.exists(os.path.join(os.path.abspath(store_path), '%s.npy' % name)) for name in STORE_FILES):
+        return build_triple_store(read_triple_file(file_path), store_path)
+    return TripleStore(store_path)
+
+class TripleStore():
+    def __init__(self, store_path):
+        self.store_path = os.path.abspath(store_path)
+        arrays = {name: np.load(os.path.join(self.store_path, '%s.npy' % name), mmap_mode='r') for name in STORE_FILES}
+        self.triples = arrays['triples']
+        self.head_offsets = arrays['head_offsets']
+        self.tail_offsets = arrays['tail_offsets']
+        self.tail_neighbors = arrays['tail_neighbors']
+        self.num_ent, self.num_rel, self.num_triples = [int(v) for v in arrays['meta']]
+
+    def __len__(self):
+        return self.num_triples
+
+    def head_degree(self, heads):
+        #number of (tail, relation) pairs of every head, works on scalars and arrays
+        heads = np.asarray(heads)
+        return self.head_offsets[heads + 1] - self.head_offsets[heads]
+
+    def tail_degree(self, tails):
+        tails = np.asarray(tails)
+        return self.tail_offsets[tails + 1] - self.tail_offsets[tails]
+
+    def tails_of(self, head):
+        #(k, 2) array of the (tail, relation) pairs of a head
+        return self.triples[self.head_offsets[head]:self.head_offsets[head + 1], 1:]
+
+    def heads_of(self, tail):
+        #(k, 2) array of the (head, relation) pairs of a tail
+        return self.tail_neighbors[self.tail_offsets[tail]:self.tail_offsets[tail + 1]]
+
+    def contains(self, triples):
+        #vectorized membership of (head, tail, relation) rows, by binary search inside every head segment
+        triples = np.asarray(triples, dtype=np.int64).reshape(-1, 3)
+        if self.num_triples == 0:
+            return np.zeros(len(triples), dtype=bool)
+        heads, keys = triples[:, 0], triples[:, 1] * self.num_rel + triples[:, 2]
+        valid = (heads >= 0) & (heads < self.num_ent) & (triples[:, 1] >= 0) & (triples[:, 2] >= 0) & (triples[:, 2] < self.num_rel)
+        heads = np.where(valid, heads, 0)
+        lo, end = self.head_offsets[heads], self.head_offsets[heads + 1]
+        hi = end.copy()
+        while True:
+            active = lo < hi
+            if not active.any():
+                break
+            mid = (lo + hi) // 2
+            mid_keys = self.triples[np.minimum(mid, self.num_triples - 1)]
+            go_right = active & (mid_keys[:, 1].astype(np.int64) * self.num_rel + mid_keys[:, 2] < keys)
+            lo = np.where(go_right, mid + 1, lo)
+            hi = np.where(active & ~go_right, mid, hi)
+        found = self.triples[np.minimum(lo, self.num_triples - 1)]
+        return valid & (lo < end) & (found[:, 1].astype(np.int64) * self.num_rel + found[:, 2] == keys)
+
+class NegativeSampler():
+    """vectorized replacement of utils.generate_corrupt_triples. the head of a positive (h, t, r) is replaced with
+    probability tph / (tph + hpt), tph being the head degree of h and hpt the tail degree of t, else its tail is.
+    degrees are computed once from the store, and with filtered set the corrupted triples that are known to be true
+    are sampled again, up to max_retries times"""
+    def __init__(self, store, num_ent=None, seed=None, filtered=False, max_retries=10):
+        self.store = store
+        self.num_ent = store.num_ent if num_ent is None else num_ent
+        self.rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+        self.filtered = filtered
+        self.max_retries = max_retries
+        self.head_degree = np.diff(np.asarray(store.head_offsets)).astype(np.float64)
+        self.tail_degree = np.diff(np.asarray(store.tail_offsets)).astype(np.float64)
+
+    def head_probability(self, pos):
+        #probability of replacing the head of every positive, 0.5 for entities unknown to the store
+        pos = np.asarray(pos, dtype=np.int64).reshape(-1, 3)
+        tph = self._degree(self.head_degree, pos[:, 0])
+        hpt = self._degree(self.tail_degree, pos[:, 1])
+        deno = tph + hpt
+        return np.divide(tph, deno, out=np.full(len(pos), 0.5), where=deno > 0)
+
+    @staticmethod
+    def _degree(degrees, ids):
+        known = (ids >= 0) & (ids < len(degrees))
+        return np.where(known, degrees[np.where(known, ids, 0)] if len(degrees) else 0.0, 0.0)
+
+    def _replace(self, neg, pos, rows, replace_head):
+        sub = self.rng.integers(self.num_ent, size=len(rows))
+        neg[rows] = pos[rows]
+        neg[rows[replace_head], 0] = sub[replace_head]
+        neg[rows[~replace_head], 1] = sub[~replace_head]
+
+    def corrupt(self, pos):
+        pos = np.asarray(pos, dtype=np.int64).reshape(-1, 3)
+        replace_head = self.rng.random(len(pos)) < self.head_probability(pos)
+        neg = pos.copy()
+        rows = np.arange(len(pos))
+        self._replace(neg, pos, rows, replace_head)
+        if self.filtered:
+            for _ in range(self.max_retries):
+                rows = np.flatnonzero(self.store.contains(neg))
+                if len(rows) == 0:
+                    break
+                self._replace(neg, pos, rows, replace_head[rows])
+        return neg
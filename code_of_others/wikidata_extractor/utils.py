@@ -1,57 +1,224 @@
 from datetime import datetime
+import atexit
 import logging
+import mmap
+import multiprocessing.util
 import os
+import struct
+import threading
+import time
+from array import array
 from collections import defaultdict, Counter
+from collections.abc import Mapping
+import hashlib
 import json
+import shutil
 import numpy as np
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
 
 
 #created custom logger to avoid logging latency in default logger
+#it keeps one file handle open per process and batches the messages, a background thread writes them
+#out every flush_secs seconds or as soon as buffer_size characters are pending
 class ManualLogger():
-    def __init__(self, name, log_file_path, use_stdout=False):
+    def __init__(self, name, log_file_path, use_stdout=False, buffer_size=1<<16, flush_secs=1.0):
         self.name = name
         self.log_file_path = log_file_path
         self.stdout = use_stdout
-    
-    def info(self, msg):
-        present_time = datetime.now()
-        msg_str = '%s [INFO] %s' % (present_time.strftime('%m/%d/%Y %I:%M:%S %p'), msg)
+        self.buffer_size = buffer_size
+        self.flush_secs = flush_secs
+        self._pid = None
+
+    def _start(self):
+        #loggers are created before the workers are forked, so every process opens its own handle and thread
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closing = False
+        self._buffer, self._buffered = [], 0
+        self._stamp_second, self._stamp = None, ''
+        self._log_file = open(os.path.abspath(self.log_file_path), 'a+')
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+        atexit.register(self.close)
+        #worker processes leave through os._exit, which skips atexit but runs the multiprocessing finalizers
+        multiprocessing.util.Finalize(self, self.close, exitpriority=10)
+
+    def _flush_loop(self):
+        while not self._closing:
+            self._wakeup.wait(self.flush_secs)
+            self._wakeup.clear()
+            self.flush()
+
+    def _log(self, level, msg):
+        if self._pid != os.getpid():
+            self._start()
+        second = int(time.time())
+        if second != self._stamp_second:
+            self._stamp = datetime.fromtimestamp(second).strftime('%m/%d/%Y %I:%M:%S %p')
+            self._stamp_second = second
+        msg_str = '%s [%s] %s' % (self._stamp, level, msg)
         if self.stdout:
             print(msg_str)
-        with open(os.path.abspath(self.log_file_path), 'a+') as log_file:
-            log_file.write(msg_str+"\n")
+        with self._lock:
+            self._buffer.append(msg_str+'\n')
+            self._buffered += len(msg_str)+1
+            if self._buffered >= self.buffer_size:
+                self._wakeup.set()
+
+    def flush(self):
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            lines, self._buffer, self._buffered = self._buffer, [], 0
+            if lines and not self._log_file.closed:
+                self._log_file.write(''.join(lines))
+                self._log_file.flush()
+
+    def close(self):
+        if self._pid != os.getpid() or self._log_file.closed:
+            return
+        self._closing = True
+        self._wakeup.set()
+        self.flush()
+        self._log_file.close()
+
+    def info(self, msg):
+        self._log('INFO', msg)
 
     def critical(self, msg):
-        present_time = datetime.now()
-        msg_str = '%s [CRITICAL] %s' % (present_time.strftime('%m/%d/%Y %I:%M:%S %p'), msg)
-        if self.stdout:
-            print(msg_str)
-        with open(os.path.abspath(self.log_file_path), 'a+') as log_file:
-            log_file.write(msg_str+"\n")
+        self._log('CRITICAL', msg)
     
     def debug(self, msg):
-        present_time = datetime.now()
-        msg_str = '%s [DEBUG] %s' % (present_time.strftime('%m/%d/%Y %I:%M:%S %p'), msg)
-        if self.stdout:
-            print(msg_str)
-        with open(os.path.abspath(self.log_file_path), 'a+') as log_file:
-            log_file.write(msg_str+'\n')
+        self._log('DEBUG', msg)
     
     def warn(self, msg):
-        present_time = datetime.now()    
-        msg_str = '%s [WARN] %s' % (present_time.strftime('%m/%d/%Y %I:%M:%S %p'), msg)
-        if self.stdout:
-            print(msg_str)    
-        with open(os.path.abspath(self.log_file_path), 'a+') as log_file:
-            log_file.write(msg_str+'\n')
+        self._log('WARN', msg)
 
     def error(self, msg):
-        present_time = datetime.now()    
-        msg_str = '%s [ERROR] %s' % (present_time.strftime('%m/%d/%Y %I:%M:%S %p'), msg)
-        if self.stdout:
-            print(msg_str)    
-        with open(os.path.abspath(self.log_file_path), 'a+') as log_file:
-            log_file.write(msg_str+'\n')        
+        self._log('ERROR', msg)
+
+#records are streamed to disk as json lines, so that memory stays flat and partial output survives a crash
+class JsonLinesWriter():
+    def __init__(self, file_path, flush_every=1000, flush_secs=30):
+        self.file_path = file_path
+        self.flush_every = flush_every
+        self.flush_secs = flush_secs
+        self.count = 0
+        self.pending = 0
+        self.last_flush = time.monotonic()
+        self.data_file = open(os.path.abspath(file_path), 'w')
+
+    def write(self, record):
+        self.data_file.write(json.dumps(record)+'\n')
+        self.count += 1
+        self.pending += 1
+        if self.pending >= self.flush_every or time.monotonic() - self.last_flush >= self.flush_secs:
+            self.flush()
+
+    def flush(self):
+        self.data_file.flush()
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.data_file.close()
+
+class MultiWriter():
+    #fans the records of one node type out to the writers of several output formats
+    def __init__(self, writers):
+        self.writers = writers
+        self.file_path = ', '.join(writer.file_path for writer in writers)
+
+    @property
+    def count(self):
+        return self.writers[0].count
+
+    def write(self, record):
+        for writer in self.writers:
+            writer.write(record)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+def iter_json_lines(file_path):
+    with open(os.path.abspath(file_path), 'r') as data_file:
+        for line in data_file:
+            yield json.loads(line)
+
+#read-only set of wikidata ids sharing one prefix (Q or P), stored as one bit per numeric id in a memory
+#mapped file, so that every worker process reads the same pages instead of holding its own copy of a set
+class IdBitmap():
+    HEADER = struct.Struct('<4sc3xQ')
+    MAGIC = b'IDBM'
+
+    def __init__(self, file_path):
+        self.file_path = os.path.abspath(file_path)
+        self._open()
+
+    def _open(self):
+        with open(self.file_path, 'rb') as bitmap_file:
+            self._map = mmap.mmap(bitmap_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, prefix, self.count = self.HEADER.unpack_from(self._map)
+        if magic != self.MAGIC:
+            raise ValueError('%s is not an id bitmap' % self.file_path)
+        self.prefix = prefix.decode('ascii')
+        self._limit = (len(self._map) - self.HEADER.size) * 8
+
+    #only the path is pickled, the receiving process maps the file again
+    def __getstate__(self):
+        return {'file_path': self.file_path}
+
+    def __setstate__(self, state):
+        self.file_path = state['file_path']
+        self._open()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, node_id):
+        try:
+            if node_id[0] != self.prefix:
+                return False
+            number = int(node_id[1:])
+        except (TypeError, ValueError, IndexError):
+            return False
+        return 0 <= number < self._limit and (self._map[self.HEADER.size + (number >> 3)] >> (number & 7)) & 1 == 1
+
+    def numbers(self):
+        bits = np.frombuffer(self._map, dtype=np.uint8, offset=self.HEADER.size)
+        return np.flatnonzero(np.unpackbits(bits, bitorder='little'))
+
+    def __iter__(self):
+        for number in self.numbers():
+            yield '%s%d' % (self.prefix, number)
+
+    def digest(self):
+        #equal id sets are stored in equal files, so the file digest identifies the set
+        return hashlib.blake2b(self._map, digest_size=16).hexdigest()
+
+    @classmethod
+    def build(cls, file_path, node_ids, prefix):
+        numbers = np.fromiter((int(i[1:]) for i in node_ids if i[:1] == prefix and i[1:].isdigit()), dtype=np.int64)
+        bits = np.zeros(int(numbers.max()) + 1 if len(numbers) else 1, dtype=bool)
+        bits[numbers] = True
+        with open(os.path.abspath(file_path), 'wb') as bitmap_file:
+            bitmap_file.write(cls.HEADER.pack(cls.MAGIC, prefix.encode('ascii'), int(bits.sum())))
+            bitmap_file.write(np.packbits(bits, bitorder='little').tobytes())
+        return cls(file_path)
+
+def as_id_bitmap(file_path, node_ids, prefix):
+    if isinstance(node_ids, IdBitmap):
+        return node_ids
+    return IdBitmap.build(file_path, node_ids, prefix)
 
 def create_logger(name, log_file, level=logging.DEBUG):
     """setup logger for each worker"""
@@ -62,28 +229,60 @@ def create_logger(name, log_file, level=logging.DEBUG):
     logger.addHandler(handler)
     return logger
 
+#entity fields read by get_node_data and get_all_attributes for the given languages
+def get_node_fields(languages=('en',)):
+    return [['id'], ['type']] + [['labels', lang] for lang in languages] + [['descriptions', lang] for lang in languages]
+
+def get_attribute_fields(languages=('en',)):
+    return get_node_fields(languages) + [['aliases', lang] for lang in languages] + [['sitelinks', '%swiki' % lang] for lang in languages] + [['claims']]
+
+def _materialise(value):
+    if isinstance(value, simdjson.Object):
+        return value.as_dict()
+    if isinstance(value, simdjson.Array):
+        return value.as_list()
+    return value
+
+def _project_fields(doc, fields):
+    #copies only the requested subtrees of a lazily parsed document into plain python objects
+    data = {}
+    for path in fields:
+        node, target = doc, data
+        for key in path[:-1]:
+            if not isinstance(node, simdjson.Object) or key not in node:
+                break
+            node, target = node[key], target.setdefault(key, {})
+        else:
+            if isinstance(node, simdjson.Object) and path[-1] in node:
+                target[path[-1]] = _materialise(node[path[-1]])
+    return data
+
+def get_json_loader(backend='auto'):
+    """returns (backend name, loads(line, fields=None)) for simdjson, orjson or the standard json module.
+    only the simdjson backend is lazy and materialises just the given fields, the others parse the whole line"""
+    if backend in ['auto', 'simdjson'] and simdjson is not None:
+        parser = simdjson.Parser()
+        def simdjson_loads(line, fields=None):
+            doc = parser.parse(line)
+            if fields is None:
+                return _materialise(doc)
+            return _project_fields(doc, fields)
+        return 'simdjson', simdjson_loads
+    if backend in ['auto', 'orjson'] and orjson is not None:
+        return 'orjson', lambda line, fields=None: orjson.loads(line)
+    if backend not in ['auto', 'json']:
+        raise ImportError('json backend %s is not installed' % backend)
+    return 'json', lambda line, fields=None: json.loads(line)
+
 def clean_str(string):
     return str(string).strip()
 
 def is_key_exists(target, data):
     #check multiple keys from the list
     if isinstance(target, list):
-        status = {}
-        for item in target:
-            status[item] = False
-        for item in data:
-            if item in target:
-                status[item] = True
-        res = True
-        for _, value in status.items():
-            res = res and value
-        return res 
-    else:
+        return all(item in data for item in target)
     #checks single key
-        for item in data:
-            if target == item:
-                return True
-    return False
+    return target in data
 
 #directly copied needs some changes
 def load_data(logger, file_path):
@@ -98,6 +297,100 @@ def load_data(logger, file_path):
     # delete_file(logger, file_path)
     return data
 
+def build_code_table(item_to_id):
+    #sorted byte string keys with their integer codes, for vectorized lookups with searchsorted
+    keys = np.array(list(item_to_id.keys()), dtype='S')
+    codes = np.array(list(item_to_id.values()), dtype=np.int32)
+    order = np.argsort(keys, kind='stable')
+    return keys[order], codes[order]
+
+def lookup_codes(code_table, items):
+    #code of every item, 0 when the item is not in the table
+    keys, codes = code_table
+    if len(keys) == 0:
+        return np.zeros(len(items), dtype=np.int32)
+    pos = np.searchsorted(keys, items)
+    pos[pos == len(keys)] = 0
+    return np.where(keys[pos] == items, codes[pos], 0).astype(np.int32)
+
+def write_coded_triples(coded_file, coded):
+    if len(coded) == 0:
+        return
+    text = coded.astype('S11')
+    lines = np.char.add(np.char.add(np.char.add(np.char.add(text[:, 0], b' '), text[:, 1]), b' '), text[:, 2])
+    coded_file.write(b'\n'.join(lines.tolist())+b'\n')
+
+def encode_triples(logger, triples_file, coded_triples_file, entities_to_id, properties_to_id, chunk_lines=1<<20, npy_file=None, dedup=True):
+    """reads `head prop tail` lines in chunks and writes `head_id prop_id tail_id` lines, the ids being looked up with
+    numpy on sorted code tables. duplicates are dropped like the former set based loading when dedup is set, which
+    needs the int32 codes of all the triples in memory. npy_file also stores the codes as an (N, 3) int32 array"""
+    entity_table, property_table = build_code_table(entities_to_id), build_code_table(properties_to_id)
+    stats = {'total': 0, 'invalid_format': 0, 'null_triples': 0, 'empty_mapping': 0, 'duplicates': 0}
+    kept = []
+    with open(os.path.abspath(triples_file), 'rb') as triples, open(os.path.abspath(coded_triples_file), 'wb') as coded_file:
+        while True:
+            lines = triples.readlines(chunk_lines * 32)
+            if not lines:
+                break
+            parts = [line.strip().split(b' ') for line in lines]
+            parts = [p for p in parts if p != [b'']]
+            valid = [p for p in parts if len(p) == 3]
+            stats['total'] += len(parts)
+            stats['invalid_format'] += len(parts) - len(valid)
+            if not valid:
+                continue
+            items = np.char.strip(np.array(valid, dtype='S'))
+            null = (np.char.str_len(items) == 0).any(axis=1)
+            stats['null_triples'] += int(null.sum())
+            items = items[~null]
+            coded = np.stack([lookup_codes(entity_table, items[:, 0]), lookup_codes(property_table, items[:, 1]), lookup_codes(entity_table, items[:, 2])], axis=1)
+            mapped = (coded != 0).all(axis=1)
+            stats['empty_mapping'] += int((~mapped).sum())
+            coded = coded[mapped]
+            if dedup or npy_file is not None:
+                kept.append(coded)
+            else:
+                write_coded_triples(coded_file, coded)
+        if dedup or npy_file is not None:
+            coded = np.concatenate(kept) if kept else np.zeros((0, 3), dtype=np.int32)
+            if dedup:
+                unique = np.unique(coded, axis=0)
+                stats['duplicates'] = len(coded) - len(unique)
+                coded = unique
+            write_coded_triples(coded_file, coded)
+            if npy_file is not None:
+                np.save(os.path.abspath(npy_file), coded)
+    logger.debug('encoded triples from %s : %s' % (triples_file, stats))
+    return stats
+
+def update_coded_triples(logger, triples_file, coded_triples_file, entities_to_id, properties_to_id, npy_file, chunk_lines=1<<20):
+    """re-encoding with stable ids, e.g. from id_registry.IdRegistry: the coded triples of npy_file that are still in
+    the triples file keep their codes and their order, the new ones are appended after them and the removed ones are
+    dropped. the text file is only appended to when it matches npy_file and no triple was removed"""
+    current_file = os.path.abspath(npy_file)+'.current.npy'
+    stats = encode_triples(logger, triples_file, os.devnull, entities_to_id, properties_to_id, chunk_lines, npy_file=current_file)
+    current = np.load(current_file)
+    os.remove(current_file)
+    #a text file written before npy_file existed holds unknown triples, it is rewritten
+    has_previous = os.path.exists(os.path.abspath(npy_file))
+    previous = np.load(os.path.abspath(npy_file)) if has_previous else np.zeros((0, 3), dtype=np.int32)
+    #rows of both arrays are numbered together, so that row membership is a 1d isin
+    _, inverse = np.unique(np.concatenate([previous, current]), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    kept = np.isin(inverse[:len(previous)], inverse[len(previous):])
+    added = current[~np.isin(inverse[len(previous):], inverse[:len(previous)])]
+    coded = np.concatenate([previous[kept], added])
+    np.save(os.path.abspath(npy_file), coded)
+    if has_previous and kept.all() and os.path.exists(os.path.abspath(coded_triples_file)):
+        with open(os.path.abspath(coded_triples_file), 'ab') as coded_file:
+            write_coded_triples(coded_file, added)
+    else:
+        with open(os.path.abspath(coded_triples_file), 'wb') as coded_file:
+            write_coded_triples(coded_file, coded)
+    stats.update({'kept': int(kept.sum()), 'added': len(added), 'removed': int((~kept).sum())})
+    logger.debug('updated coded triples from %s : %s' % (triples_file, stats))
+    return stats
+
 def create_mapping(freq, min_freq=0, max_vocab=50000):
     freq = freq.most_common(max_vocab)
     item2id = {
@@ -117,12 +410,68 @@ def create_dict(item_list):
     freq = Counter(item_list)
     return freq
 
+#approximate word counts in a fixed size table, used when the vocabulary does not fit in an exact Counter
+class CountMinSketch():
+    def __init__(self, width=1<<20, depth=4, seed=0):
+        rng = np.random.default_rng(seed)
+        self.width = width
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.mult = rng.integers(1, 1<<62, size=depth, dtype=np.uint64) | np.uint64(1)
+        self.inc = rng.integers(0, 1<<62, size=depth, dtype=np.uint64)
+
+    def _columns(self, items):
+        #the builtin hash() is salted per process, a digest of the utf-8 bytes gives the same counts in every run
+        digests = {}
+        for i in items:
+            if i not in digests:
+                digests[i] = int.from_bytes(hashlib.blake2b(i.encode('utf-8'), digest_size=8).digest(), 'little')
+        hashes = np.fromiter((digests[i] for i in items), dtype=np.uint64, count=len(items))
+        return ((hashes[None, :] * self.mult[:, None] + self.inc[:, None]) >> np.uint64(17)) % np.uint64(self.width)
+
+    def add(self, items):
+        for row, columns in enumerate(self._columns(items)):
+            np.add.at(self.table[row], columns.astype(np.int64), 1)
+
+    def estimate(self, items):
+        columns = self._columns(items).astype(np.int64)
+        return self.table[np.arange(len(self.table))[:, None], columns].min(axis=0)
+
+def count_words(documents, max_vocab=50000, use_sketch=False, batch_size=1<<16):
+    """word frequencies of an iterable of token lists. the exact Counter grows with the vocabulary, with use_sketch
+    the counts come from a count-min sketch and at most 4 * max_vocab candidate words are kept, pruned to the best
+    half by estimated count whenever the candidates overflow"""
+    if not use_sketch:
+        freq = Counter()
+        for tokens in documents:
+            freq.update(tokens)
+        return freq
+    sketch = CountMinSketch()
+    capacity = 4 * max_vocab
+    candidates, batch = set(), []
+    def flush_batch():
+        nonlocal candidates, batch
+        sketch.add(batch)
+        candidates.update(batch)
+        batch = []
+        if len(candidates) > capacity:
+            #sorted words make the ties of the stable argsort independent of the set order
+            words = sorted(candidates)
+            best = np.argsort(-sketch.estimate(words), kind='stable')[:capacity // 2]
+            candidates = set(words[i] for i in best)
+    for tokens in documents:
+        batch.extend(tokens)
+        if len(batch) >= batch_size:
+            flush_batch()
+    flush_batch()
+    words = sorted(candidates)
+    return Counter(dict(zip(words, sketch.estimate(words).tolist())))
+
 def prepare_mapping(words, min_freq):
     words = [w.lower() for w in words]
     words_freq = create_dict(words)
     word2id, id2word = create_mapping(words_freq, min_freq)
     print("Found %i unique words (%i in total)" % (
-        len(word2id), sum(len(x) for x in words)
+        len(word2id), len(words)
     ))
 
     mappings = {
@@ -132,32 +481,271 @@ def prepare_mapping(words, min_freq):
 
     return mappings
 
-def load_text(f, min_freq, max_len):
-    with open(f) as jsf:
-        txt = json.load(jsf)
-    words = []
-    new_txt = {}
-    for key in txt:
+def iter_json_object_items(file_path, chunk_size=1<<20):
+    #streams the (key, value) pairs of a top level json object without loading the whole file
+    decoder = json.JSONDecoder()
+    with open(os.path.abspath(file_path), 'r') as jsf:
+        buf, pos, eof = '', 0, False
+        def more(size):
+            nonlocal buf, pos, eof
+            data = jsf.read(size)
+            eof = len(data) == 0
+            buf, pos = buf[pos:] + data, 0
+        def peek():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return buf[pos:pos+1]
+                more(chunk_size)
+        def decode():
+            nonlocal pos
+            size = chunk_size
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    #a value ending with the buffer may be cut, e.g. a number
+                    if end < len(buf) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                more(size)
+                size *= 2
+        if peek() != '{':
+            raise ValueError('%s does not hold a json object' % file_path)
+        pos += 1
+        if peek() == '}':
+            return
+        while True:
+            peek()
+            key = decode()
+            if peek() != ':':
+                raise ValueError('malformed json object in %s' % file_path)
+            pos += 1
+            peek()
+            yield key, decode()
+            separator = peek()
+            pos += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise ValueError('malformed json object in %s' % file_path)
+
+def iter_text_tokens(f, max_len):
+    #lowercased tokens of every text, sentences are joined with <eos> and cut to max_len
+    for key, sentences in iter_json_object_items(f):
         tmp = []
-        for sent in txt[key]:
+        for sent in sentences:
             tmp.extend(sent)
             tmp.append('<eos>')
-        tmp = tmp[:max_len]
-        new_txt[key] = tmp
-        words.extend(tmp)
-    mappings = prepare_mapping(words, min_freq)
-    word2idx = mappings["word2idx"]
-
-    vectorize_txt = defaultdict(list)
-    for key in new_txt:
-        for w in new_txt[key]:
-            try:
-                vectorize_txt[key].append(word2idx[w])
-            except:
-                vectorize_txt[key].append(word2idx['<unk>'])
+        yield key, [w.lower() for w in tmp[:max_len]]
+
+#word ids of every text stored in one int32 array, the ids of the i-th key are ids[offsets[i]:offsets[i+1]]
+class VectorizedText():
+    def __init__(self, keys, ids, offsets, key_index=None):
+        self.text_keys = keys
+        self.ids = ids
+        self.offsets = offsets
+        self.key_index = {key: i for i, key in enumerate(keys)} if key_index is None else key_index
+
+    def __getitem__(self, key):
+        i = self.key_index[key]
+        return self.ids[self.offsets[i]:self.offsets[i+1]]
+
+    def get(self, key, default=None):
+        return self[key] if key in self.key_index else default
+
+    def __contains__(self, key):
+        return key in self.key_index
+
+    def __iter__(self):
+        return iter(self.text_keys)
+
+    def __len__(self):
+        return len(self.text_keys)
+
+    def keys(self):
+        return list(self.text_keys)
+
+    def items(self):
+        for key in self.text_keys:
+            yield key, self[key]
+
+#read-only string <-> integer table in one memory mapped file. strings are sorted by their utf-8 bytes and stored
+#in a blob with offsets, so a lookup is a binary search and nothing is decoded before it is used
+class StringTable():
+    HEADER = struct.Struct('<4sQq')
+    MAGIC = b'STRT'
+
+    def __init__(self, file_path):
+        self.file_path = os.path.abspath(file_path)
+        with open(self.file_path, 'rb') as table_file:
+            self._map = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, self.extra = self.HEADER.unpack_from(self._map)
+        if magic != self.MAGIC:
+            raise ValueError('%s is not a string table' % self.file_path)
+        arrays, pos = [], self.HEADER.size
+        for size in [count+1, count, count, count]:
+            arrays.append(np.frombuffer(self._map, dtype=np.int64, count=size, offset=pos))
+            pos += 8*size
+        #offsets and ids are in string order, sorted_ids and id_positions in id order
+        self.offsets, self.ids, self.sorted_ids, self.id_positions = arrays
+        self._blob = pos
+        self.count = count
+        self.str2id = _StringToId(self)
+        self.id2str = _IdToString(self)
+
+    def __len__(self):
+        return self.count
+
+    def bytes_at(self, position):
+        return self._map[self._blob+int(self.offsets[position]):self._blob+int(self.offsets[position+1])]
+
+    def position_of(self, string):
+        key = string.encode('utf-8')
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.bytes_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.count and self.bytes_at(lo) == key else -1
+
+    def position_of_id(self, item_id):
+        pos = int(np.searchsorted(self.sorted_ids, item_id))
+        return int(self.id_positions[pos]) if pos < self.count and self.sorted_ids[pos] == item_id else -1
+
+    @classmethod
+    def build(cls, file_path, items, extra=0):
+        #items are (string, id) pairs, the file is written aside and moved in place once complete
+        pairs = sorted((string.encode('utf-8'), int(item_id)) for string, item_id in items)
+        offsets = np.zeros(len(pairs)+1, dtype=np.int64)
+        np.cumsum([len(string) for string, _ in pairs], out=offsets[1:])
+        ids = np.array([item_id for _, item_id in pairs], dtype=np.int64)
+        id_positions = np.argsort(ids, kind='stable').astype(np.int64)
+        with open(os.path.abspath(file_path)+'.tmp', 'wb') as table_file:
+            table_file.write(cls.HEADER.pack(cls.MAGIC, len(pairs), extra))
+            for values in [offsets, ids, ids[id_positions], id_positions]:
+                table_file.write(values.tobytes())
+            table_file.write(b''.join(string for string, _ in pairs))
+        os.replace(os.path.abspath(file_path)+'.tmp', os.path.abspath(file_path))
+        return cls(file_path)
+
+class _StringToId(Mapping):
+    def __init__(self, table):
+        self.table = table
+
+    def __getitem__(self, string):
+        position = self.table.position_of(string) if isinstance(string, str) else -1
+        if position == -1:
+            raise KeyError(string)
+        return int(self.table.ids[position])
+
+    def __iter__(self):
+        for position in range(len(self.table)):
+            yield self.table.bytes_at(position).decode('utf-8')
+
+    def __len__(self):
+        return len(self.table)
+
+class _IdToString(Mapping):
+    def __init__(self, table):
+        self.table = table
+
+    def __getitem__(self, item_id):
+        try:
+            position = self.table.position_of_id(int(item_id))
+        except (TypeError, ValueError):
+            position = -1
+        if position == -1:
+            raise KeyError(item_id)
+        return self.table.bytes_at(position).decode('utf-8')
+
+    def __iter__(self):
+        for item_id in self.table.sorted_ids:
+            yield int(item_id)
+
+    def __len__(self):
+        return len(self.table)
+
+def file_digest(file_path, *params):
+    #cache key of a file content together with the parameters used to process it
+    digest = hashlib.blake2b(repr(params).encode('utf-8'), digest_size=16)
+    with open(os.path.abspath(file_path), 'rb') as data_file:
+        for block in iter(lambda: data_file.read(1<<20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _load_text_cache(cache_path):
+    vocab = StringTable(os.path.join(cache_path, 'vocab.strtab'))
+    keys = StringTable(os.path.join(cache_path, 'keys.strtab'))
+    mappings = {
+        'word2idx': vocab.str2id,
+        'idx2word': vocab.id2str,
+    }
+    ids = np.load(os.path.join(cache_path, 'ids.npy'), mmap_mode='r')
+    offsets = np.load(os.path.join(cache_path, 'offsets.npy'), mmap_mode='r')
+    #text keys are numbered in file order, so iterating the ids gives back the original order
+    return mappings, VectorizedText(keys.id2str.values(), ids, offsets, key_index=keys.str2id)
+
+def _store_text_cache(cache_path, mappings, vectorize_txt):
+    tmp_path = cache_path+'.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    StringTable.build(os.path.join(tmp_path, 'vocab.strtab'), mappings['word2idx'].items())
+    StringTable.build(os.path.join(tmp_path, 'keys.strtab'), ((key, i) for i, key in enumerate(vectorize_txt.text_keys)))
+    np.save(os.path.join(tmp_path, 'ids.npy'), vectorize_txt.ids)
+    np.save(os.path.join(tmp_path, 'offsets.npy'), vectorize_txt.offsets)
+    os.replace(tmp_path, cache_path)
+
+def load_text(f, min_freq, max_len, max_vocab=50000, use_sketch=False, cache_dir=None):
+    """two streaming passes over the file: the first one counts the words, the second one maps them to ids.
+    with cache_dir the mappings and ids are saved under a hash of the file and the parameters, and a warm start
+    memory maps them instead, the mappings becoming read-only lazy lookups"""
+    if cache_dir is not None:
+        cache_path = os.path.join(os.path.abspath(cache_dir), 'text-%s' % file_digest(f, min_freq, max_len, max_vocab, use_sketch))
+        if os.path.isdir(cache_path):
+            return _load_text_cache(cache_path)
+    #the total is counted on the tokens, the sketch counts being estimates
+    token_count = 0
+    def documents():
+        nonlocal token_count
+        for _, tokens in iter_text_tokens(f, max_len):
+            token_count += len(tokens)
+            yield tokens
+    freq = count_words(documents(), max_vocab, use_sketch)
+    word2idx, idx2word = create_mapping(freq, min_freq, max_vocab)
+    print("Found %i unique words (%i in total)" % (
+        len(word2idx), token_count
+    ))
+    mappings = {
+        'word2idx': word2idx,
+        'idx2word': idx2word
+    }
+
+    unk = word2idx['<unk>']
+    keys, ids, offsets = [], array('i'), [0]
+    for key, tokens in iter_text_tokens(f, max_len):
+        ids.extend([word2idx.get(w, unk) for w in tokens])
+        keys.append(key)
+        offsets.append(len(ids))
+    vectorize_txt = VectorizedText(keys, np.frombuffer(ids, dtype=np.int32), np.array(offsets, dtype=np.int64))
+    if cache_dir is not None:
+        os.makedirs(os.path.abspath(cache_dir), exist_ok=True)
+        _store_text_cache(cache_path, mappings, vectorize_txt)
     return mappings, vectorize_txt
 
-def load_dict(f):
+def load_dict(f, cache_dir=None):
+    if cache_dir is not None:
+        #warm starts map the cached table, whose id2str view replaces the dict
+        cache_file = os.path.join(os.path.abspath(cache_dir), 'dict-%s.strtab' % file_digest(f))
+        if os.path.exists(cache_file):
+            table = StringTable(cache_file)
+            return table.id2str, table.extra
     fo = open(f)
     d = {}
     num = int(fo.readline().strip())
@@ -165,6 +753,9 @@ def load_dict(f):
         line = line.strip()
         name, idd = line.split('\t')
         d[int(idd)] = name
+    if cache_dir is not None:
+        os.makedirs(os.path.abspath(cache_dir), exist_ok=True)
+        StringTable.build(cache_file, ((name, idd) for idd, name in d.items()), extra=num)
     return d, num
 
 def load_triples(kg_f):
@@ -176,6 +767,7 @@ def load_triples(kg_f):
         if len(ele)==3:
             ele = list(map(int, ele))
             triples.append(ele)
+    return triples
 
 def load_triple_dict(f):
     fo = open(f)